@@ -1,3 +1,18 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Cart, CartLine
+
+
+class CartLineAdminInline(admin.TabularInline):
+    model = CartLine
+    raw_id_fields = ('product',)
+
+
+class CartAdmin(admin.ModelAdmin):
+    inlines = (CartLineAdminInline,)
+    list_display = ('pk', 'user', 'created')
+    raw_id_fields = ('user',)
+    ordering = ('-created',)
+
+
+admin.site.register(Cart, CartAdmin)
@@ -0,0 +1,88 @@
+"""
+JSON versions of the bag views, so the bag can be changed from
+JavaScript without reloading the page. Each response has the changed
+line and the new bag totals. The views in bag/views.py stay for
+browsers without JavaScript.
+"""
+from decimal import Decimal
+
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET, require_POST
+
+from products.models import Product
+
+from .utils import add_item, adjust_item, get_bag, get_cart, remove_item
+
+CENTS = Decimal('0.01')
+
+
+def _money(amount):
+    return str(Decimal(amount).quantize(CENTS))
+
+
+def _summary(request):
+    summary = get_bag(request).summary()
+    return {
+        'total': _money(summary['total']),
+        'product_count': summary['product_count'],
+        'delivery': _money(summary['delivery']),
+        'free_delivery_delta': _money(summary['free_delivery_delta']),
+        'grand_total': _money(summary['grand_total']),
+    }
+
+
+def _change_bag(request, item_id, change):
+    """Apply one of the bag changes from bag/utils.py and describe the result"""
+    product = get_object_or_404(Product, pk=item_id)
+    size = request.POST.get('product_size') or None
+    cart = get_cart(request, create=True)
+
+    if change is remove_item:
+        quantity, message = change(cart, product, size)
+    else:
+        try:
+            quantity = int(request.POST.get('quantity'))
+            # Adjusting to zero removes the product, adding needs at least one
+            if quantity < (1 if change is add_item else 0):
+                raise ValueError
+        except (TypeError, ValueError):
+            return JsonResponse({'error': 'Please enter a valid quantity.'}, status=400)
+        quantity, message = change(cart, product, quantity, size)
+
+    get_bag(request).invalidate()
+    return JsonResponse({
+        'message': message,
+        'line': {
+            'item_id': str(product.id),
+            'size': size,
+            'quantity': quantity,
+            'price': _money(product.price),
+            'subtotal': _money(product.price * quantity),
+        },
+        'bag': _summary(request),
+    })
+
+
+@require_POST
+def add_to_bag(request, item_id):
+    """Add a quantity of a product to the bag"""
+    return _change_bag(request, item_id, add_item)
+
+
+@require_POST
+def adjust_bag(request, item_id):
+    """Set the quantity of a product in the bag, removing it at zero"""
+    return _change_bag(request, item_id, adjust_item)
+
+
+@require_POST
+def remove_from_bag(request, item_id):
+    """Remove a product from the bag"""
+    return _change_bag(request, item_id, remove_item)
+
+
+@require_GET
+def bag_summary(request):
+    """The bag totals, for refreshing the bag shown in the page header"""
+    return JsonResponse({'bag': _summary(request)})
@@ -1,64 +1,21 @@
-from decimal import Decimal
 from django.conf import settings
-from django.shortcuts import get_object_or_404
-from products.models import Product
 
+from .utils import get_bag
 
-def bag_contents(request):
-
-    bag_items = []
-    total = 0
-    product_count = 0
-    bag = request.session.get('bag', {})
-
-    for item_id, item_data in bag.items():  # bag.items is the bag from session
-        # Check if item_data is integer. 
-        # If it's an integer then we know the item data is just the quantity.
-        # Otherwise we know it's a dictionary and we need to handle it differently.
-        if isinstance(item_data, int):
-            product = get_object_or_404(Product, pk=item_id)
-            total += item_data * product.price
-            product_count += item_data
-            bag_items.append({
-                'item_id': item_id,
-                'quantity': item_data,
-                'product': product,
-
-            })
-        # So if item_data is dictionary (has sizes), we'll actually need to iterate through the inner dictionary of items_by_size
-        # incrementing the product count and total accordingly.
-        else:
-            product = get_object_or_404(Product, pk=item_id)
-            for size, quantity in item_data['items_by_size'].items():
-                total += quantity * product.price
-                product_count += quantity
-                bag_items.append({
-                    'item_id': item_id,
-                    'quantity': quantity,
-                    'product': product,
-                    'size': size,
-                })
 
-
-    # settings.FREE_DELIVERY_TRESHOLD - reffers to the variable we created in settings.py
-    if total < settings.FREE_DELIVERY_TRESHOLD:
-        delivery = total * Decimal(settings.STANDARD_DELIVERY_PERCENTAGE / 100)
-        free_delivery_delta = settings.FREE_DELIVERY_TRESHOLD - total
-    else:
-        delivery = 0
-        free_delivery_delta = 0
-
-    grand_total = delivery + total
-
-    context = {
-        'bag_items': bag_items,
-        'total': total,
-        'product_count': product_count,
-        'delivery': delivery,
-        'free_delivery_delta': free_delivery_delta,
-        'free_delivery_treshold': settings.FREE_DELIVERY_TRESHOLD,
-        'grand_total': grand_total,
-    }
+def bag_contents(request):
+    """
+    Make the bag available to all templates.
+    The values are lazy, so pages that never show the bag
+    don't touch the session or the database for it.
+    """
+    bag = get_bag(request)
+
+    context = {key: bag.lazy(key) for key in (
+        'bag_items', 'total', 'product_count', 'delivery',
+        'free_delivery_delta', 'grand_total',
+    )}
+    context['free_delivery_treshold'] = settings.FREE_DELIVERY_TRESHOLD
 
     return context
 
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def calculate_totals(apps, schema_editor):
+    """Snapshot the line prices and work out the totals of existing carts"""
+    Cart = apps.get_model('bag', 'Cart')
+    for cart in Cart.objects.prefetch_related('lines__product'):
+        lines = list(cart.lines.all())
+        for line in lines:
+            line.price = line.product.price
+            line.save(update_fields=['price'])
+        cart.total = sum(line.price * line.quantity for line in lines)
+        cart.product_count = sum(line.quantity for line in lines)
+        cart.save(update_fields=['total', 'product_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bag', '0001_initial'),
+        ('products', '0005_product_price_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='priced_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='cartline',
+            name='price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=6),
+        ),
+        migrations.RunPython(calculate_totals, migrations.RunPython.noop),
+    ]
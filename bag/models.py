@@ -1,3 +1,130 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from products.models import Product
+
+
+class Cart(models.Model):
+    """
+    A shopping bag stored in the database.
+    Logged in users have one cart each. Anonymous visitors' carts
+    are found through the cart id stored in their session.
+
+    The cart keeps a running total and product count, updated with
+    each change to its lines, so showing the bag doesn't mean adding
+    up every line. Each line keeps the price it was added at. If any
+    product's price changed since `priced_at`, the totals are worked
+    out again by recalculate().
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True, related_name='cart')
+    created = models.DateTimeField(auto_now_add=True)
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    product_count = models.PositiveIntegerField(default=0)
+    priced_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'Cart {self.pk} ({self.user or "anonymous"})'
+
+    def _change_totals(self, quantity, amount):
+        Cart.objects.filter(pk=self.pk).update(
+            total=F('total') + amount,
+            product_count=F('product_count') + quantity,
+        )
+
+    def add(self, product, quantity, size=''):
+        """
+        Add to the quantity of a product in the cart.
+        The quantity is increased in the database itself, so adding from
+        two tabs at once can't lose either update.
+        Returns the new quantity and whether the product is new to the cart.
+        """
+        if quantity < 1:
+            raise ValueError(f'Can only add a positive quantity, not {quantity}')
+        lines = self.lines.filter(product=product, size=size)
+        with transaction.atomic():
+            created = False
+            if not lines.update(quantity=F('quantity') + quantity):
+                try:
+                    with transaction.atomic():
+                        self.lines.create(product=product, size=size, quantity=quantity, price=product.price)
+                    created = True
+                except IntegrityError:
+                    # Another request added the product in the meantime,
+                    # anything else that failed is raised again
+                    if not lines.update(quantity=F('quantity') + quantity):
+                        raise
+            self._change_totals(quantity, quantity * product.price)
+        if created:
+            return quantity, True
+        return lines.values_list('quantity', flat=True).get(), False
+
+    def set_quantity(self, product, quantity, size=''):
+        """Set the quantity of a product in the cart, removing it at zero"""
+        with transaction.atomic():
+            line = self.lines.select_for_update().filter(product=product, size=size).first()
+            if line is None:
+                if quantity > 0:
+                    self.add(product, quantity, size)
+            elif quantity <= 0:
+                # The totals are updated by bag.signals.cart_line_deleted
+                line.delete()
+            else:
+                change = quantity - line.quantity
+                line.quantity = quantity
+                line.save(update_fields=['quantity'])
+                self._change_totals(change, change * line.price)
+
+    def remove(self, product, size=''):
+        self.set_quantity(product, 0, size)
+
+    def merge(self, other):
+        """Move everything in another cart into this one, and delete the other cart"""
+        for line in other.lines.select_related('product'):
+            self.add(line.product, line.quantity, line.size)
+        other.delete()
+
+    def recalculate(self):
+        """
+        Update every line to its product's current price,
+        then work the totals out again from the lines
+        """
+        with transaction.atomic():
+            # Taken before the prices are read, so a price changed while
+            # this runs makes the cart recalculate again next time
+            priced_at = timezone.now()
+            Cart.objects.select_for_update().filter(pk=self.pk).exists()
+            self.lines.update(price=Subquery(
+                Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1]))
+            totals = self.lines.aggregate(
+                total=Sum(F('quantity') * F('price'), output_field=DecimalField()),
+                product_count=Sum('quantity'),
+            )
+            self.total = totals['total'] or 0
+            self.product_count = totals['product_count'] or 0
+            self.priced_at = priced_at
+            self.save(update_fields=['total', 'product_count', 'priced_at'])
+
+
+class CartLine(models.Model):
+    """
+    One product, in one size if it has sizes, in a cart,
+    with the price it had when it was added.
+    Products without sizes have an empty size.
+    """
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product', 'size'], name='unique_cart_line'),
+        ]
+
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    size = models.CharField(max_length=20, blank=True, default='')
+    quantity = models.PositiveIntegerField(default=1)
+    price = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_id} {self.size}'.strip()
 
-# Create your models here.
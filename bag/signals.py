@@ -0,0 +1,36 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Cart, CartLine
+from .utils import CART_SESSION_KEY
+
+
+@receiver(user_logged_in)
+def merge_carts(sender, request, user, **kwargs):
+    """
+    Keep what was put in the bag before logging in,
+    by moving it into the user's own cart
+    """
+    if request is None or not hasattr(request, 'session'):
+        return
+    cart_id = request.session.pop(CART_SESSION_KEY, None)
+    anonymous_cart = Cart.objects.filter(pk=cart_id, user=None).first() if cart_id else None
+    if anonymous_cart is None:
+        return
+
+    user_cart = Cart.objects.filter(user=user).first()
+    if user_cart is None:
+        anonymous_cart.user = user
+        anonymous_cart.save(update_fields=['user'])
+    else:
+        user_cart.merge(anonymous_cart)
+
+
+@receiver(post_delete, sender=CartLine)
+def cart_line_deleted(sender, instance, **kwargs):
+    """
+    Take a removed line off its cart's totals, including
+    the lines deleted along with a deleted product
+    """
+    Cart(pk=instance.cart_id)._change_totals(-instance.quantity, -instance.quantity * instance.price)
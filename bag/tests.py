@@ -1,3 +1,139 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
 
-# Create your tests here.
+from boutique_ado.testing import QueryBudgetMixin
+from products.models import Category, Product
+
+from .models import Cart
+from .utils import _carts
+
+
+class BagPageQueryTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='shirts', friendly_name='Shirts')
+        cls.products = [
+            Product.objects.create(
+                category=category, sku=f'sku{number}', name=f'Shirt {number}',
+                description='A shirt', price=20, has_sizes=bool(number % 2),
+            )
+            for number in range(10)
+        ]
+
+    def setUp(self):
+        for product in self.products:
+            data = {'quantity': 2, 'redirect_url': reverse('view_bag')}
+            if product.has_sizes:
+                data['product_size'] = 'm'
+            self.client.post(reverse('add_to_bag', args=[product.id]), data)
+
+    def test_bag_query_budget(self):
+        # The session, the cart and its lines with their products.
+        # The "added to bag" messages are in a cookie, so the session isn't saved.
+        with self.assertMaxQueries(3):
+            response = self.client.get(reverse('view_bag'))
+        self.assertContains(response, 'Shirt 9')
+
+    def test_adjust_bag_query_budget(self):
+        product = self.products[0]
+        # The product, the session, the cart, then the line and the cart totals
+        with self.assertMaxQueries(6):
+            self.client.post(reverse('adjust_bag', args=[product.id]), {'quantity': 5})
+        response = self.client.get(reverse('view_bag'))
+        self.assertEqual(response.context['product_count'](), 23)
+
+    def test_bag_total_query_budget(self):
+        # Show the "added to bag" messages, whose toast lists the bag
+        self.client.get(reverse('view_bag'))
+        # Pages that only show the bag total read it from the cart
+        with self.assertMaxQueries(2):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['grand_total'](), 400)
+
+    def test_price_change_updates_total(self):
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.price = 30
+        product.save()
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['total'](), 420)
+
+    def test_other_price_changes_keep_totals(self):
+        # Only price changes to products in the cart mean working out its totals again
+        Product.objects.create(sku='new', name='New shirt', description='A shirt', price=25)
+        self.assertFalse(_carts().get().prices_changed)
+        Product.objects.filter(pk=self.products[0].pk).update(price_updated=timezone.now())
+        self.assertTrue(_carts().get().prices_changed)
+
+
+class CartMergeTests(TestCase):
+
+    def test_bag_is_kept_on_login(self):
+        category = Category.objects.create(name='jeans', friendly_name='Jeans')
+        product = Product.objects.create(category=category, name='Jeans', description='Jeans', price=40)
+        user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        Cart.objects.create(user=user).add(product, 1)
+
+        self.client.post(reverse('add_to_bag', args=[product.id]), {'quantity': 2, 'redirect_url': '/'})
+        self.client.login(username='shopper', password='password')
+
+        self.assertEqual(Cart.objects.count(), 1)
+        self.assertEqual(user.cart.lines.get().quantity, 3)
+
+    def test_old_session_bag_with_bad_quantities(self):
+        products = [
+            Product.objects.create(name=f'Shirt {number}', description='A shirt', price=20, has_sizes=number == 2)
+            for number in range(3)
+        ]
+        session = self.client.session
+        session['bag'] = {
+            str(products[0].pk): 0,
+            str(products[1].pk): 1,
+            str(products[2].pk): {'items_by_size': {'m': -2, 's': 'two', 'l': 1}},
+            '9999': 1,
+        }
+        session.save()
+
+        response = self.client.get(reverse('view_bag'))
+        self.assertEqual(response.status_code, 200)
+        lines = Cart.objects.get().lines.order_by('product')
+        self.assertEqual([(line.product, line.size, line.quantity) for line in lines],
+                         [(products[1], '', 1), (products[2], 'l', 1)])
+
+
+class BagApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='shirts', friendly_name='Shirts')
+        cls.shirt = Product.objects.create(
+            category=category, name='Shirt', description='A shirt', price=20, has_sizes=True)
+
+    def test_add_adjust_and_remove(self):
+        url = reverse('api_add_to_bag', args=[self.shirt.id])
+        self.client.post(url, {'quantity': 1, 'product_size': 'm'})
+        response = self.client.post(url, {'quantity': 2, 'product_size': 'm'})
+        self.assertEqual(response.json()['line']['quantity'], 3)
+        self.assertEqual(response.json()['line']['subtotal'], '60.00')
+        self.assertEqual(response.json()['bag']['total'], '60.00')
+        self.assertEqual(response.json()['bag']['product_count'], 3)
+
+        response = self.client.post(
+            reverse('api_adjust_bag', args=[self.shirt.id]), {'quantity': 1, 'product_size': 'm'})
+        self.assertEqual(response.json()['bag']['total'], '20.00')
+
+        response = self.client.post(reverse('api_remove_from_bag', args=[self.shirt.id]), {'product_size': 'm'})
+        self.assertEqual(response.json()['line']['quantity'], 0)
+        self.assertEqual(self.client.get(reverse('api_bag_summary')).json()['bag']['total'], '0.00')
+
+    def test_invalid_quantity(self):
+        response = self.client.post(reverse('api_add_to_bag', args=[self.shirt.id]), {'quantity': 'many'})
+        self.assertEqual(response.status_code, 400)
+        for quantity in (0, -1):
+            response = self.client.post(reverse('api_add_to_bag', args=[self.shirt.id]), {'quantity': quantity})
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('api_adjust_bag', args=[self.shirt.id]), {'quantity': -5})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_bag_summary')).json()['bag']['product_count'], 0)
@@ -0,0 +1,238 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils.functional import cached_property
+
+from products.models import Product
+
+from .models import Cart
+
+# The session only holds the id of an anonymous visitor's cart
+CART_SESSION_KEY = 'cart_id'
+
+
+def get_bag_products(bag):
+    """
+    Fetch every product referenced by the bag in a single query.
+    Returns a dictionary of products keyed by the bag's (string) item ids.
+    Item ids that no longer match a product are simply left out.
+    """
+    product_ids = [item_id for item_id in bag.keys() if str(item_id).isdigit()]
+    products = Product.objects.in_bulk(product_ids)
+    return {str(pk): product for pk, product in products.items()}
+
+
+def _carts():
+    """
+    Carts, with whether the price of any product in the cart has changed
+    since the cart's totals were worked out. Only the cart's own lines are
+    looked at, so prices changing elsewhere in the shop don't matter.
+    """
+    return Cart.objects.annotate(prices_changed=Exists(
+        Product.objects.filter(cartline__cart=OuterRef('pk'), price_updated__gt=OuterRef('priced_at'))))
+
+
+def _old_bag_items(bag):
+    """
+    The item id, size and quantity of everything in a bag from the session.
+    Old bags could hold quantities of zero or less, which are skipped.
+    """
+    for item_id, item_data in bag.items():
+        if isinstance(item_data, dict):
+            sizes = item_data.get('items_by_size')
+            quantities = sizes.items() if isinstance(sizes, dict) else []
+        else:
+            quantities = [('', item_data)]
+        for size, quantity in quantities:
+            if isinstance(quantity, int) and quantity > 0:
+                yield item_id, size, quantity
+
+
+def get_cart(request, create=False):
+    """
+    Return the cart for this request: the user's own cart, or for
+    anonymous visitors the cart their session points to.
+    Returns None if there's no cart yet, unless `create` is True.
+    """
+    # Bags from before carts were kept in the database are moved into one
+    old_bag = request.session.pop('bag', None)
+    create = create or bool(old_bag)
+
+    if request.user.is_authenticated:
+        if create:
+            cart, created = _carts().get_or_create(user=request.user)
+        else:
+            cart = _carts().filter(user=request.user).first()
+    else:
+        cart_id = request.session.get(CART_SESSION_KEY)
+        cart = _carts().filter(pk=cart_id, user=None).first() if cart_id else None
+        if cart is None and create:
+            cart = Cart.objects.create()
+            request.session[CART_SESSION_KEY] = cart.pk
+
+    if old_bag:
+        products = get_bag_products(old_bag)
+        for item_id, size, quantity in _old_bag_items(old_bag):
+            if item_id in products:
+                cart.add(products[item_id], quantity, size)
+        cart.recalculate()
+    elif cart is not None and getattr(cart, 'prices_changed', False):
+        cart.recalculate()
+    return cart
+
+
+def clear_cart(request):
+    """Empty the bag, after a successful checkout"""
+    cart = get_cart(request)
+    if cart is not None:
+        cart.delete()
+    request.session.pop(CART_SESSION_KEY, None)
+
+
+def add_item(cart, product, quantity, size=None):
+    """
+    Add a product to the cart.
+    Returns the new quantity and the message to show the user.
+    """
+    if size:
+        quantity, created = cart.add(product, quantity, size)
+        if created:
+            return quantity, f'Added size {size.upper()} {product.name} to your shopping bag'
+        return quantity, f'Updated size {size.upper()} {product.name} quantity to {quantity}'
+
+    quantity, created = cart.add(product, quantity)
+    if created:
+        return quantity, f'Added {product.name} to your shopping bag'
+    return quantity, f'Updated {product.name} quantity to {quantity}'
+
+
+def adjust_item(cart, product, quantity, size=None):
+    """
+    Set the quantity of a product in the cart, removing it at zero.
+    Returns the new quantity and the message to show the user.
+    """
+    if quantity <= 0:
+        return remove_item(cart, product, size)
+
+    cart.set_quantity(product, quantity, size or '')
+    if size:
+        return quantity, f'Updated size {size.upper()} {product.name} quantity to {quantity}'
+    return quantity, f'Updated {product.name} quantity to {quantity}'
+
+
+def remove_item(cart, product, size=None):
+    """
+    Remove a product from the cart.
+    Returns the new quantity, which is 0, and the message to show the user.
+    """
+    cart.remove(product, size or '')
+    if size:
+        return 0, f'Removed size {size.upper()} {product.name} from your shopping bag'
+    return 0, f'Removed {product.name} from your shopping bag'
+
+
+def delivery_totals(total):
+    """The delivery cost, grand total and how far off free delivery a bag total is"""
+    # settings.FREE_DELIVERY_TRESHOLD - reffers to the variable we created in settings.py
+    if total < settings.FREE_DELIVERY_TRESHOLD:
+        delivery = total * Decimal(settings.STANDARD_DELIVERY_PERCENTAGE / 100)
+        free_delivery_delta = settings.FREE_DELIVERY_TRESHOLD - total
+    else:
+        delivery = 0
+        free_delivery_delta = 0
+
+    return {
+        'delivery': delivery,
+        'free_delivery_delta': free_delivery_delta,
+        'grand_total': delivery + total,
+    }
+
+
+class Bag:
+    """
+    A lazy view of the shopping bag, as the templates use it.
+    Nothing is read from the session or the database until one of the
+    bag values is accessed, after which the result is kept for the rest
+    of the request.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def cart(self):
+        return get_cart(self.request)
+
+    @cached_property
+    def totals(self):
+        """
+        The totals kept on the cart, so they don't depend on
+        how many products are in the bag
+        """
+        total = self.cart.total if self.cart else 0
+        return {
+            'total': total,
+            'product_count': self.cart.product_count if self.cart else 0,
+            **delivery_totals(total),
+        }
+
+    @cached_property
+    def bag_items(self):
+        bag_items = []
+        # Every line with its product in a single query
+        lines = self.cart.lines.select_related('product').order_by('pk') if self.cart else []
+        for line in lines:
+            bag_item = {
+                'item_id': str(line.product_id),
+                'quantity': line.quantity,
+                'product': line.product,
+            }
+            if line.size:
+                bag_item['size'] = line.size
+            bag_items.append(bag_item)
+        return bag_items
+
+    def __getitem__(self, key):
+        if key == 'bag_items':
+            return self.bag_items
+        return self.totals[key]
+
+    def lazy(self, key):
+        """
+        Return a callable for the given bag value.
+        Templates call callables when they resolve a variable,
+        so the bag is only computed if a template actually uses it.
+        """
+        return lambda: self[key]
+
+    def summary(self):
+        """The bag's totals without its items"""
+        return self.totals
+
+    def invalidate(self):
+        """Forget what was read about the bag so far, after the bag has changed"""
+        for name in ('cart', 'totals', 'bag_items'):
+            self.__dict__.pop(name, None)
+
+    def as_dict(self):
+        """
+        The bag in the format it used to have in the session, which is what's
+        saved with the order and sent to Stripe:
+        {item_id: quantity} or {item_id: {'items_by_size': {size: quantity}}}
+        """
+        bag = {}
+        for bag_item in self['bag_items']:
+            if 'size' in bag_item:
+                sizes = bag.setdefault(bag_item['item_id'], {'items_by_size': {}})
+                sizes['items_by_size'][bag_item['size']] = bag_item['quantity']
+            else:
+                bag[bag_item['item_id']] = bag_item['quantity']
+        return bag
+
+
+def get_bag(request):
+    """Return the bag for this request, creating it on first use"""
+    if not hasattr(request, '_cached_bag'):
+        request._cached_bag = Bag(request)
+    return request._cached_bag
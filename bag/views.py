@@ -3,6 +3,8 @@ from django.contrib import messages
 
 from products.models import Product
 
+from .utils import add_item, adjust_item, get_cart, remove_item
+
 # Create your views here.
 
 
@@ -22,28 +24,15 @@ def add_to_bag(request, item_id):
     if 'product_size' in request.POST:
         size = request.POST['product_size']
 
-    bag = request.session.get('bag', {})
-
-    if size:
-        if item_id in list(bag.keys()):
-            if size in bag[item_id]['items_by_size'].keys():
-                bag[item_id]['items_by_size'][size] += quantity
-                messages.success(request, f'Updated size {size.upper()} {product.name} quantity to {bag[item_id]["items_by_size"][size]}')
-            else:
-                bag[item_id]['items_by_size'][size] = quantity
-                messages.success(request, f'Added size {size.upper()} {product.name} to your shopping bag')
-        else:
-            bag[item_id] = {'items_by_size': {size: quantity}}
-            messages.success(request, f'Added size {size.upper()} {product.name} to your shopping bag')
-    else:
-        if item_id in list(bag.keys()):
-            bag[item_id] += quantity
-            messages.success(request, f'Updated {product.name} quantity to {bag[item_id]}')
-        else:
-            bag[item_id] = quantity
-            messages.success(request, f'Added {product.name} to your shopping bag')
-
-    request.session['bag'] = bag
+    # The quantity is added in the database, see bag/models.py
+    if quantity < 1:
+        messages.error(request, 'Please enter a valid quantity.')
+        return redirect(redirect_url)
+
+    cart = get_cart(request, create=True)
+
+    _, message = add_item(cart, product, quantity, size)
+    messages.success(request, message)
 
     return redirect(redirect_url)
 
@@ -82,26 +71,14 @@ def adjust_bag(request, item_id):
     size = None
     if 'product_size' in request.POST:
         size = request.POST['product_size']
-    bag = request.session.get('bag', {})
-
-    if size:
-        if quantity > 0:
-            bag[item_id]['items_by_size'][size] = quantity
-            messages.success(request, f'Updated size {size.upper()} {product.name} quantity to {bag[item_id]["items_by_size"][size]}')
-        else:
-            del bag[item_id]['items_by_size'][size]
-            if not bag[item_id]['items_by_size']:
-                bag.pop(item_id)
-            messages.success(request, f'Removed size {size.upper()} {product.name} from your shopping bag')
-    else:
-        if quantity > 0:
-            bag[item_id] = quantity
-            messages.success(request, f'Updated {product.name} quantity to {bag[item_id]}')
-        else:
-            bag.pop(item_id)
-            messages.success(request, f'Removed {product.name} from your shopping bag')
-
-    request.session['bag'] = bag
+    if quantity < 0:
+        messages.error(request, 'Please enter a valid quantity.')
+        return redirect(reverse('view_bag'))
+    cart = get_cart(request, create=True)
+
+    _, message = adjust_item(cart, product, quantity, size)
+    messages.success(request, message)
+
     return redirect(reverse('view_bag'))
 
 # adjust_bag view 
@@ -125,18 +102,11 @@ def remove_from_bag(request, item_id):
         size = None
         if 'product_size' in request.POST:
             size = request.POST['product_size']
-        bag = request.session.get('bag', {})
-
-        if size:
-            del bag[item_id]['items_by_size'][size]
-            if not bag[item_id]['items_by_size']:
-                bag.pop(item_id)
-            messages.success(request, f'Removed size {size.upper()} {product.name} from your shopping bag')
-        else:
-            bag.pop(item_id)
-            messages.success(request, f'Removed {product.name} from your shopping bag')
-
-        request.session['bag'] = bag
+        cart = get_cart(request, create=True)
+
+        _, message = remove_item(cart, product, size)
+        messages.success(request, message)
+
         return HttpResponse(status=200)
 
     except Exception as e:
@@ -0,0 +1,28 @@
+"""
+Helpers shared by the benchmark commands, and by the Stripe call stats
+in checkout/payments.py.
+"""
+import math
+from contextlib import contextmanager
+
+from django.db import transaction
+
+
+class Rollback(Exception):
+    """Raised to throw away what a benchmark put in the database"""
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that's always rolled back"""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def percentile(values, percent):
+    """The `percent`th percentile of a sorted list of values, by nearest rank"""
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
@@ -0,0 +1,283 @@
+"""
+Where the time goes in each request.
+
+PerformanceMiddleware times a sample of requests (PERFORMANCE_SAMPLE_RATE
+of them) and, for each, how long was spent on:
+
+- database queries, and how many there were
+- rendering templates, which includes the context processors
+- the cache, and how many reads hit or missed
+- calls to other services, like Stripe (see timed())
+
+The timings of a request are sent as a Server-Timing header, which the
+browser's developer tools show, when DEBUG is on or the user is staff.
+Each sampled request is also logged as a line of JSON to the
+boutique_ado.performance logger, and added to totals for each view that
+metrics() serves in the Prometheus text format.
+
+Requests that aren't sampled only cost a random number.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template.exceptions import TemplateDoesNotExist
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+# The timings of the request being handled, None if it isn't sampled
+_current = ContextVar('request_timings', default=None)
+
+# Names and descriptions of the Server-Timing metrics
+TIMINGS = {
+    'db': 'Database',
+    'tpl': 'Templates',
+    'cache': 'Cache',
+    'ext': 'External calls',
+}
+
+# The Prometheus counters of each view: the timing they're the total of,
+# their name and description, and what to divide by for seconds
+PROMETHEUS_COUNTERS = [
+    ('requests', 'http_sampled_requests_total', 'Requests sampled', 1),
+    ('wall_ms', 'http_request_seconds_total', 'Time spent handling sampled requests', 1000),
+    ('db_ms', 'http_db_seconds_total', 'Time spent in database queries in sampled requests', 1000),
+    ('db_queries', 'http_db_queries_total', 'Database queries in sampled requests', 1),
+    ('tpl_ms', 'http_template_seconds_total', 'Time spent rendering templates in sampled requests', 1000),
+    ('cache_ms', 'http_cache_seconds_total', 'Time spent using the cache in sampled requests', 1000),
+    ('cache_hits', 'http_cache_hits_total', 'Cache reads that found a value in sampled requests', 1),
+    ('cache_misses', 'http_cache_misses_total', 'Cache reads that found nothing in sampled requests', 1),
+    ('ext_ms', 'http_external_seconds_total', 'Time spent calling other services in sampled requests', 1000),
+]
+
+
+class RequestTimings:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = defaultdict(float)
+        self.db_queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # How many templates are being rendered inside one another
+        self.template_depth = 0
+
+    def as_dict(self):
+        return {
+            'wall_ms': round((time.perf_counter() - self.start) * 1000, 2),
+            **{f'{name}_ms': round(self.seconds[name] * 1000, 2) for name in TIMINGS},
+            'db_queries': self.db_queries,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+@contextmanager
+def timed(name='ext'):
+    """
+    Add the time spent in the block to the current request's timings,
+    e.g. `with timed(): ...` around a call to another service
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.seconds[name] += time.perf_counter() - start
+
+
+def _time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if timings is not None:
+            timings.seconds['db'] += time.perf_counter() - start
+            timings.db_queries += 1
+
+
+def _instrument_cache(cache):
+    """
+    Time the reads and writes of a cache, and count the hits and misses.
+    Each thread has its own cache objects, so they're changed once each.
+    """
+    if getattr(cache, '_timed', False):
+        return
+    get, get_many = cache.get, cache.get_many
+
+    def timed_get(key, default=None, version=None, **kwargs):
+        timings = _current.get()
+        if timings is None:
+            return get(key, default, version, **kwargs)
+        with timed('cache'):
+            value = get(key, default, version, **kwargs)
+        if value is default:
+            timings.cache_misses += 1
+        else:
+            timings.cache_hits += 1
+        return value
+
+    def timed_get_many(keys, version=None, **kwargs):
+        timings = _current.get()
+        if timings is None:
+            return get_many(keys, version, **kwargs)
+        keys = list(keys)
+        with timed('cache'):
+            values = get_many(keys, version, **kwargs)
+        timings.cache_hits += len(values)
+        timings.cache_misses += len(keys) - len(values)
+        return values
+
+    for method in ('set', 'add', 'delete', 'incr'):
+        original = getattr(cache, method)
+        setattr(cache, method, _timed_method(original))
+    cache.get, cache.get_many = timed_get, timed_get_many
+    cache._timed = True
+
+
+def _timed_method(method):
+    def timed_method(*args, **kwargs):
+        with timed('cache'):
+            return method(*args, **kwargs)
+    return timed_method
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        # Templates rendered by other templates, like crispy forms,
+        # are part of the time of the outermost one
+        timings.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template_depth -= 1
+            if not timings.template_depth:
+                timings.seconds['tpl'] += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing how long templates take to render"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class ViewMetrics:
+    """Totals of the sampled requests to each view, since the process started"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = defaultdict(lambda: defaultdict(float))
+
+    def add(self, view, timings):
+        with self.lock:
+            totals = self.totals[view]
+            totals['requests'] += 1
+            for name, value in timings.items():
+                totals[name] += value
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for key, name, description, divisor in PROMETHEUS_COUNTERS:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} counter')
+                for view, totals in sorted(self.totals.items()):
+                    lines.append(f'{name}{{view="{view}"}} {totals[key] / divisor:g}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.totals.clear()
+
+
+view_metrics = ViewMetrics()
+
+
+class PerformanceMiddleware:
+    """
+    Time a sample of requests, see the top of this module.
+    Goes first in MIDDLEWARE, so the time of the other middleware counts too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.PERFORMANCE_SAMPLE_RATE:
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_time_query))
+                for cache in caches.all():
+                    _instrument_cache(cache)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        view = getattr(request.resolver_match, 'view_name', None) or 'unresolved'
+        results = timings.as_dict()
+        view_metrics.add(view, results)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            **results,
+        }))
+        if settings.DEBUG or getattr(getattr(request, 'user', None), 'is_staff', False):
+            response['Server-Timing'] = self.server_timing(results)
+        return response
+
+    def server_timing(self, results):
+        metrics = [f'total;dur={results["wall_ms"]}']
+        for name, description in TIMINGS.items():
+            if name == 'db':
+                description = f'{description} ({results["db_queries"]} queries)'
+            elif name == 'cache':
+                description = f'{description} ({results["cache_hits"]} hits, {results["cache_misses"]} misses)'
+            metrics.append(f'{name};dur={results[f"{name}_ms"]};desc="{description}"')
+        return ', '.join(metrics)
+
+
+def metrics(request):
+    """
+    The per view totals in the Prometheus text format, for staff or for
+    a scraper sending PERFORMANCE_METRICS_TOKEN as a bearer token.
+    Each worker process keeps its own totals.
+    """
+    token = settings.PERFORMANCE_METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not request.user.is_staff and not (token and constant_time_compare(authorization, f'Bearer {token}')):
+        return HttpResponseForbidden()
+    return HttpResponse(view_metrics.prometheus(), content_type='text/plain; version=0.0.4')
@@ -60,6 +60,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so it times the rest of the middleware too
+    'boutique_ado.performance.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,7 +78,8 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django template backend, timing each render for the performance middleware
+        'BACKEND': 'boutique_ado.performance.TimedDjangoTemplates',
         'DIRS': [
             os.path.join(BASE_DIR, 'templates'),
             os.path.join(BASE_DIR, 'templates', 'allauth'),
@@ -99,7 +102,30 @@ TEMPLATES = [
     },
 ]
 
-MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
+# Share of requests the performance middleware times, from 0 to 1
+PERFORMANCE_SAMPLE_RATE = float(os.environ.get('PERFORMANCE_SAMPLE_RATE', 1 if DEBUG else 0.05))
+# Lets a Prometheus scraper read /metrics/ with this bearer token
+PERFORMANCE_METRICS_TOKEN = os.environ.get('PERFORMANCE_METRICS_TOKEN')
+
+# Set PERFORMANCE_LOG_LEVEL=INFO to log the timings of every sampled request
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'boutique_ado.performance': {
+            'handlers': ['console'],
+            'level': os.environ.get('PERFORMANCE_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+# Messages go in a cookie, and only in the session if they don't fit,
+# so showing a message doesn't mean saving the whole session again
+MESSAGE_STORAGE = 'django.contrib.messages.storage.fallback.FallbackStorage'
 
 
 AUTHENTICATION_BACKENDS = [
@@ -139,6 +165,47 @@ else:
         }
     }
 
+# Caches
+# Local memory by default, which each process keeps to itself.
+# Set REDIS_URL to share one cache between all the processes,
+# or CACHE_DIR to keep the cache in files on this machine.
+if 'REDIS_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+elif 'CACHE_DIR' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Whether every process sees the same cache. When they don't, something
+# thrown away by one process is still cached in the others.
+SHARED_CACHE = 'REDIS_URL' in os.environ or 'CACHE_DIR' in os.environ
+
+# Sessions
+# Sessions are read from the cache when it's shared by all the processes,
+# and still written to the database so nobody loses their bag when it's cleared.
+# Local memory caches aren't shared, so sessions come straight from the database.
+# Set SESSION_ENGINE to pick any other session backend.
+if 'SESSION_ENGINE' in os.environ:
+    SESSION_ENGINE = os.environ.get('SESSION_ENGINE')
+elif SHARED_CACHE:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -173,6 +240,34 @@ USE_L10N = True
 USE_TZ = True
 
 
+# Product listing
+PRODUCTS_PER_PAGE = 24
+# Numbered pages before sorted listings switch to keyset pagination
+PRODUCTS_OFFSET_PAGES = 5
+
+# Orders per page of the order history on the profile page
+ORDERS_PER_PAGE = 10
+
+# Seconds to cache product counts and rendered product grids for, 0 to
+# not cache them. Both are also thrown away when a product or category changes,
+# but only in the process that changed it unless the cache is shared, so
+# without a shared cache they're only kept for a few seconds.
+PRODUCTS_COUNT_CACHE_TIMEOUT = 60 * 60 if SHARED_CACHE else 5
+PRODUCTS_GRID_CACHE_TIMEOUT = 60 * 60 if SHARED_CACHE else 5
+# Seconds to cache user profiles for. They're thrown away when saved, but
+# like the catalog caches only everywhere when the cache is shared. The
+# process_stripe_events worker saves profiles too.
+PROFILE_CACHE_TIMEOUT = 60 * 60 if SHARED_CACHE else 5
+
+# Widths of the thumbnails made of each product image
+PRODUCT_IMAGE_WIDTHS = [160, 320, 640]
+
+# Product search
+# The backend is picked to suit the database unless PRODUCT_SEARCH_BACKEND is set,
+# e.g. 'products.search.IContainsSearchBackend'. See products/search.py.
+PRODUCT_SEARCH_MAX_RESULTS = 1000
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
@@ -219,6 +314,19 @@ STRIPE_CURRENCY = 'usd'
 STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY')
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
 STRIPE_WH_SECRET = os.environ.get('STRIPE_WH_SECRET')
+# Where Stripe API calls go, api.stripe.com unless set,
+# e.g. to the fake server started by run_fake_stripe
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')
+STRIPE_API_TIMEOUT = 10  # seconds for each call to the Stripe API
+STRIPE_API_MAX_RETRIES = 2  # retries after network errors
+# Webhook events are queued and handled by `manage.py process_stripe_events`
+STRIPE_WH_MAX_ATTEMPTS = 5
+STRIPE_WH_RETRY_DELAY = 30  # seconds, doubled after each failed attempt
+STRIPE_WH_CLAIM_TIMEOUT = 300  # seconds before an unfinished event is retried
+
+# Emails are queued and sent by `manage.py send_queued_emails`
+EMAIL_QUEUE_MAX_ATTEMPTS = 5
+EMAIL_QUEUE_RETRY_DELAY = 60  # seconds, doubled after each failed attempt
 
 if 'DEVELOPMENT' in os.environ:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin to check a page stays within a fixed number of queries,
+    so an N+1 query shows up as a failing test rather than a slow page.
+    """
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        # Savepoints only show up because each test runs in a transaction
+        captured = [query for query in context.captured_queries if 'SAVEPOINT' not in query['sql']]
+        executed = len(captured)
+        if executed > budget:
+            queries = '\n'.join(
+                f'{number}. {query["sql"]}'
+                for number, query in enumerate(captured, start=1)
+            )
+            self.fail(f'{executed} queries executed, the budget is {budget}:\n{queries}')
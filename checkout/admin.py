@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import Order, OrderLineItem
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .exports import CONTENT_TYPES, export_orders
+from .models import Order, OrderLineItem, QueuedEmail, StripeEvent
 
 
 class OrderLineItemAdminInline(admin.TabularInline):
@@ -34,10 +38,68 @@ class OrderAdmin(admin.ModelAdmin):
                     'order_total', 'delivery_cost', 'grand_total',)
 
     ordering = ('-date',)
+    actions = ('export_as_csv', 'export_as_json')
+
+    def export(self, queryset, format):
+        """
+        Stream the export to the browser as it's written,
+        so even every order at once doesn't have to fit in memory
+        """
+        response = StreamingHttpResponse(export_orders(queryset, format),
+                                         content_type=CONTENT_TYPES[format])
+        filename = f'orders-{timezone.now():%Y%m%d-%H%M%S}.{format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def export_as_csv(self, request, queryset):
+        return self.export(queryset, 'csv')
+    export_as_csv.short_description = 'Export selected orders as CSV'
+
+    def export_as_json(self, request, queryset):
+        return self.export(queryset, 'json')
+    export_as_json.short_description = 'Export selected orders as JSON'
 
 # Finally I'll register the Order model and the OrderAdmin.
 # But I'm going to skip registering the OrderLineItem model.
 # Since it's accessible via the inline on the order model.
 
 
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'status', 'attempts',
+                    'created', 'processed_at', 'order')
+    list_filter = ('status', 'event_type')
+    search_fields = ('event_id', 'order__order_number')
+    readonly_fields = ('event_id', 'event_type', 'payload', 'attempts',
+                       'last_error', 'order', 'created', 'processed_at')
+    ordering = ('-created',)
+    actions = ('retry_events',)
+
+    def retry_events(self, request, queryset):
+        """Put failed events back in the queue"""
+        updated = queryset.exclude(status=StripeEvent.DONE).update(
+            status=StripeEvent.PENDING, attempts=0, available_at=timezone.now())
+        self.message_user(request, f'{updated} event(s) queued again.')
+    retry_events.short_description = 'Retry selected events'
+
+
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts',
+                    'created', 'sent_at', 'send_latency_ms')
+    list_filter = ('status',)
+    search_fields = ('subject', 'to')
+    readonly_fields = ('attempts', 'last_error', 'created',
+                       'sent_at', 'send_latency_ms')
+    ordering = ('-created',)
+    actions = ('retry_emails',)
+
+    def retry_emails(self, request, queryset):
+        """Put failed emails back in the queue"""
+        updated = queryset.exclude(status=QueuedEmail.SENT).update(
+            status=QueuedEmail.PENDING, attempts=0, available_at=timezone.now())
+        self.message_user(request, f'{updated} email(s) queued again.')
+    retry_emails.short_description = 'Retry selected emails'
+
+
 admin.site.register(Order, OrderAdmin)
+admin.site.register(StripeEvent, StripeEventAdmin)
+admin.site.register(QueuedEmail, QueuedEmailAdmin)
@@ -0,0 +1,99 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import payments
+from .models import StripeEvent
+from .webhook_handler import StripeWH_Handler
+
+
+def enqueue_event(event, payload):
+    """
+    Store a verified Stripe event in the inbox.
+    Returns True if it's new, or False if it has already been delivered.
+    """
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    stripe_event, created = StripeEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={'event_type': event['type'], 'payload': payload},
+    )
+    return created
+
+
+def claim_events(limit):
+    """
+    Claim up to `limit` events that are due for processing.
+
+    Each event is claimed with a conditional update, so several workers
+    can run side by side without handling the same event twice.
+    A claim hides the event for STRIPE_WH_CLAIM_TIMEOUT seconds, after
+    which it's picked up again in case the worker died half way through.
+    """
+    now = timezone.now()
+    due = Q(status__in=[StripeEvent.PENDING, StripeEvent.PROCESSING], available_at__lte=now)
+    candidates = StripeEvent.objects.filter(due).order_by('available_at').values_list('pk', flat=True)[:limit]
+
+    claimed = []
+    for pk in candidates:
+        updated = StripeEvent.objects.filter(due, pk=pk).update(
+            status=StripeEvent.PROCESSING,
+            attempts=F('attempts') + 1,
+            available_at=now + timedelta(seconds=settings.STRIPE_WH_CLAIM_TIMEOUT),
+        )
+        if updated:
+            claimed.append(pk)
+    return claimed
+
+
+def dispatch_event(event):
+    """Pass the event on to the relevant StripeWH_Handler method"""
+    # Set up a webhook handler
+    handler = StripeWH_Handler(None)
+
+    # Map webhook events to relevant handler functions
+    event_map = {
+        'payment_intent.succeeded': handler.handle_payment_intent_succeeded,
+        'payment_intent.payment_failed': handler.handle_payment_intent_payment_failed,
+    }
+
+    # If there's a handler for it, get it from the event map
+    # Use the generic one by default
+    event_handler = event_map.get(event['type'], handler.handle_event)
+    return event_handler(event)
+
+
+def process_event(pk):
+    """
+    Handle a claimed event.
+    Failed events are retried with an exponential backoff, and are
+    dead-lettered as failed after STRIPE_WH_MAX_ATTEMPTS attempts.
+    """
+    stripe_event = StripeEvent.objects.get(pk=pk)
+
+    try:
+        event = payments.event_from_payload(stripe_event.payload)
+        response = dispatch_event(event)
+        error = None
+        if response.status_code >= 500:
+            error = response.content.decode('utf-8')
+    except Exception as e:
+        error = repr(e)
+
+    now = timezone.now()
+    if error is None:
+        stripe_event.status = StripeEvent.DONE
+        stripe_event.processed_at = now
+        stripe_event.last_error = ''
+    elif stripe_event.attempts >= settings.STRIPE_WH_MAX_ATTEMPTS:
+        stripe_event.status = StripeEvent.FAILED
+        stripe_event.last_error = error
+    else:
+        delay = settings.STRIPE_WH_RETRY_DELAY * 2 ** (stripe_event.attempts - 1)
+        stripe_event.status = StripeEvent.PENDING
+        stripe_event.available_at = now + timedelta(seconds=delay)
+        stripe_event.last_error = error
+    stripe_event.save(update_fields=['status', 'processed_at', 'available_at', 'last_error'])
+    return stripe_event
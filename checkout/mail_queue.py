@@ -0,0 +1,93 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import QueuedEmail
+
+# How long a claimed email is hidden from other senders
+CLAIM_TIMEOUT = 300
+
+
+def queue_email(subject, body, from_email, recipient_list):
+    """Queue an email for the background sender, in place of send_mail"""
+    return QueuedEmail.objects.create(
+        subject=subject.strip(),
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=','.join(recipient_list),
+    )
+
+
+def claim_emails(limit):
+    """
+    Claim up to `limit` emails that are due to be sent.
+    Uses a conditional update so several senders can run at once.
+    """
+    now = timezone.now()
+    due = {'status': QueuedEmail.PENDING, 'available_at__lte': now}
+    candidates = QueuedEmail.objects.filter(**due).order_by('available_at').values_list('pk', flat=True)[:limit]
+
+    claimed = []
+    for pk in candidates:
+        if QueuedEmail.objects.filter(pk=pk, **due).update(
+                attempts=F('attempts') + 1,
+                available_at=now + timedelta(seconds=CLAIM_TIMEOUT)):
+            claimed.append(pk)
+    return QueuedEmail.objects.filter(pk__in=claimed).order_by('pk')
+
+
+def send_queued_emails(batch_size=50, backend=None):
+    """
+    Send a batch of queued emails over a single connection.
+    Each email's send time is recorded, and failures are retried
+    with an exponential backoff up to EMAIL_QUEUE_MAX_ATTEMPTS times.
+    Returns the emails that were processed.
+    """
+    emails = list(claim_emails(batch_size))
+    if not emails:
+        return []
+
+    connection = get_connection(backend=backend)
+    try:
+        connection.open()
+    except Exception as e:
+        # Couldn't connect, so try the whole batch again later
+        for email in emails:
+            _failed(email, e)
+        return emails
+
+    try:
+        for email in emails:
+            message = EmailMessage(
+                email.subject, email.body, email.from_email,
+                email.to.split(','), connection=connection,
+            )
+            start = time.perf_counter()
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                _failed(email, e)
+                continue
+            email.send_latency_ms = (time.perf_counter() - start) * 1000
+            email.status = QueuedEmail.SENT
+            email.sent_at = timezone.now()
+            email.last_error = ''
+            email.save(update_fields=['send_latency_ms', 'status', 'sent_at', 'last_error'])
+    finally:
+        connection.close()
+
+    return emails
+
+
+def _failed(email, error):
+    if email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+        email.status = QueuedEmail.FAILED
+    else:
+        delay = settings.EMAIL_QUEUE_RETRY_DELAY * 2 ** (email.attempts - 1)
+        email.available_at = timezone.now() + timedelta(seconds=delay)
+    email.last_error = repr(error)
+    email.save(update_fields=['status', 'available_at', 'last_error'])
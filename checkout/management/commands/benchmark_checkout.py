@@ -0,0 +1,78 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from boutique_ado.benchmarking import percentile
+from checkout import payments
+from checkout.stripe_fakes import FakeStripeServer
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure checkout page throughput against the fake Stripe API, '
+        'with a few products in the bag of each simulated shopper, and '
+        'report the latency of the Stripe calls it made.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Number of checkout pages to load')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Number of shoppers loading the page at once')
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help='Seconds the fake Stripe API takes to answer each call')
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.values_list('id', flat=True)[:3])
+        if not product_ids:
+            raise CommandError('Load some products before running the benchmark.')
+
+        with FakeStripeServer(latency=options['latency']) as server, override_settings(
+                STRIPE_API_BASE=server.url, STRIPE_SECRET_KEY='sk_test_fake', ALLOWED_HOSTS=['*']):
+            payments.stats.reset()
+            per_shopper = max(options['requests'] // options['concurrency'], 1)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                timings = [
+                    timing
+                    for shopper_timings in executor.map(
+                        lambda _: self.shop(product_ids, per_shopper), range(options['concurrency']))
+                    for timing in shopper_timings
+                ]
+            elapsed = time.perf_counter() - start
+
+        latencies = sorted(timing * 1000 for timing in timings)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(timings)} checkout pages in {elapsed:.1f}s ({len(timings) / elapsed:.1f}/s), '
+            f'p50 {statistics.median(latencies):.1f}ms, '
+            f'p95 {percentile(latencies, 95):.1f}ms'
+        ))
+        for call, call_stats in payments.call_stats().items():
+            self.stdout.write(
+                f'    {call}: {call_stats["count"]} calls, {call_stats["errors"]} errors, '
+                f'p50 {call_stats["p50_ms"]:.1f}ms, p95 {call_stats["p95_ms"]:.1f}ms')
+
+    def shop(self, product_ids, requests):
+        """Runs in a thread, as one shopper reloading the checkout page"""
+        client = Client()
+        try:
+            for product_id in product_ids:
+                client.post(reverse('api_add_to_bag', args=[product_id]), {'quantity': 1})
+            timings = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                response = client.get(reverse('checkout'))
+                timings.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise CommandError(f'The checkout page returned {response.status_code}')
+            return timings
+        finally:
+            # Each thread has its own database connection
+            connection.close()
@@ -0,0 +1,113 @@
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from boutique_ado.benchmarking import rolled_back
+from checkout.models import Order
+from products.models import Category, Product
+from profiles.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        'Print the query plan and p50 latency of the hot order and product '
+        'lookups, on generated orders and products that are rolled back '
+        'afterwards. Run it before and after migrating to compare the indexes '
+        'added in checkout 0008 and products 0004.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=50000)
+        parser.add_argument('--products', type=int, default=20000)
+        parser.add_argument('--profiles', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Number of times each query is timed')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        with rolled_back():
+            self.fill(rng, options)
+            for label, queryset in self.lookups(rng):
+                self.measure(label, queryset, options['repeat'])
+
+    def lookups(self, rng):
+        order = Order.objects.order_by('?').first()
+        product = Product.objects.exclude(sku=None).order_by('?').first()
+        categories = list(Category.objects.values_list('name', flat=True)[:2])
+        return [
+            ('Order by order number (checkout_success, order_history)',
+             Order.objects.filter(order_number=order.order_number)),
+            ('Order by payment intent (webhook)',
+             Order.objects.filter(stripe_pid=order.stripe_pid)),
+            ("A user's order history (profile)",
+             Order.objects.filter(user_profile=order.user_profile_id).order_by('-date')[:20]),
+            ('Newest orders (admin)',
+             Order.objects.order_by('-date')[:100]),
+            ('Product by sku',
+             Product.objects.filter(sku=product.sku)),
+            ('Products in categories',
+             Product.objects.filter(category__name__in=categories)[:24]),
+            ('Products sorted by name',
+             Product.objects.annotate(lower_name=Lower('name')).order_by('lower_name')[:24]),
+        ]
+
+    def measure(self, label, queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(queryset.all())
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{label}: p50 {statistics.median(timings):.2f}ms'))
+        for line in queryset.explain().splitlines():
+            self.stdout.write(f'    {line}')
+
+    def fill(self, rng, options):
+        """Generate categories, products, profiles and orders to query"""
+        batch_size = options['batch_size']
+        suffix = uuid.uuid4().hex[:8]
+        categories = Category.objects.bulk_create(
+            [Category(name=f'benchmark_{suffix}_{number}') for number in range(20)])
+        categories = list(Category.objects.filter(name__startswith=f'benchmark_{suffix}'))
+
+        for start in range(0, options['products'], batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    category=rng.choice(categories),
+                    sku=f'{suffix}{number}',
+                    name=f'Benchmark Product {rng.randint(0, 10 ** 6)}',
+                    description='Generated by benchmark_lookups',
+                    price=rng.randint(5, 200),
+                )
+                for number in range(start, min(start + batch_size, options['products']))
+            ])
+
+        User.objects.bulk_create([
+            User(username=f'benchmark_{suffix}_{number}') for number in range(options['profiles'])])
+        users = User.objects.filter(username__startswith=f'benchmark_{suffix}_')
+        UserProfile.objects.bulk_create([UserProfile(user=user) for user in users])
+        profiles = list(UserProfile.objects.filter(user__in=users))
+
+        # bulk_create skips Order.save, so the order numbers are set here.
+        # Each batch is dated a day earlier than the last.
+        now = timezone.now()
+        for day, start in enumerate(range(0, options['orders'], batch_size)):
+            created = Order.objects.bulk_create([
+                Order(
+                    order_number=uuid.uuid4().hex.upper(),
+                    user_profile=rng.choice(profiles),
+                    full_name='Benchmark Customer', email='customer@example.com',
+                    phone_number='0123456789', country='IE', town_or_city='Dublin',
+                    street_address1='1 Fake Street', stripe_pid=f'pi_{uuid.uuid4().hex}',
+                )
+                for _ in range(start, min(start + batch_size, options['orders']))
+            ])
+            Order.objects.filter(order_number__in=[order.order_number for order in created]).update(
+                date=now - timedelta(days=day))
@@ -0,0 +1,137 @@
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection
+from django.test.utils import override_settings
+
+from boutique_ado.benchmarking import percentile
+from checkout.event_queue import claim_events, enqueue_event, process_event
+from checkout.models import Order, StripeEvent
+from checkout.order_builder import build_order
+from checkout.stripe_fakes import fake_payment_intent_payload, sign_payload
+from products.models import Product
+
+import stripe
+
+BENCHMARK_SECRET = 'whsec_benchmark'
+
+
+def percentiles(timings):
+    latencies = sorted(elapsed * 1000 for elapsed in timings)
+    if not latencies:
+        return 'no samples'
+    return (
+        f'p50 {statistics.median(latencies):.1f}ms '
+        f'p95 {percentile(latencies, 95):.1f}ms '
+        f'max {latencies[-1]:.1f}ms'
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure webhook latency when the same payment_intent.succeeded events '
+        'are delivered concurrently, then how long the worker takes to handle '
+        'them while racing the web checkout. SQLite only allows one writer at '
+        'a time, so run it against Postgres for realistic numbers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=100,
+                            help='Number of fake payments to process')
+        parser.add_argument('--deliveries', type=int, default=2,
+                            help='How many times each event is delivered')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Number of worker threads')
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the orders and events created by the benchmark")
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.values_list('id', flat=True)[:5])
+        if not product_ids:
+            raise CommandError('Load some products before running the benchmark.')
+        bag = {str(product_id): 1 for product_id in product_ids}
+
+        payloads = [fake_payment_intent_payload(bag) for _ in range(options['payments'])]
+        pids = [payload['data']['object']['id'] for payload in payloads]
+        event_ids = [payload['id'] for payload in payloads]
+        timings = {'receive': [], 'process': []}
+        errors = []
+        lock = threading.Lock()
+
+        def timed(kind, func, *args):
+            connection.ensure_connection()
+            start = time.perf_counter()
+            try:
+                func(*args)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+            elapsed = time.perf_counter() - start
+            connection.close()
+            with lock:
+                timings[kind].append(elapsed)
+
+        def receive(payload):
+            # What the webhook view does for each delivery
+            body = json.dumps(payload)
+            event = stripe.Webhook.construct_event(body, sign_payload(body, BENCHMARK_SECRET), BENCHMARK_SECRET)
+            enqueue_event(event, body)
+
+        def web_checkout(payload):
+            # What checkout.views.checkout does when the form is submitted
+            intent = payload['data']['object']
+            order = Order(
+                full_name='Fake Customer', email='customer@example.com',
+                phone_number='0123456789', country='IE', town_or_city='Dublin',
+                street_address1='1 Fake Street', stripe_pid=intent['id'],
+                original_bag=intent['metadata']['bag'],
+            )
+            try:
+                build_order(order, bag)
+            except IntegrityError:
+                # The webhook got there first
+                pass
+            finally:
+                connection.close()
+
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.dummy.EmailBackend'):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                for payload in payloads:
+                    for _ in range(options['deliveries']):
+                        executor.submit(timed, 'receive', receive, payload)
+            receive_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                for payload in payloads:
+                    executor.submit(web_checkout, payload)
+                while True:
+                    claimed = claim_events(options['concurrency'])
+                    if not claimed:
+                        break
+                    list(executor.map(lambda pk: timed('process', process_event, pk), claimed))
+            process_time = time.perf_counter() - started
+
+        events = StripeEvent.objects.filter(event_id__in=event_ids)
+        orders = Order.objects.filter(stripe_pid__in=pids)
+        self.stdout.write(
+            f'Webhook deliveries: {len(timings["receive"])} in {receive_time:.2f}s, '
+            f'{percentiles(timings["receive"])}'
+        )
+        self.stdout.write(
+            f'Events handled: {len(timings["process"])} in {process_time:.2f}s, '
+            f'{percentiles(timings["process"])}'
+        )
+        self.stdout.write(
+            f'Queued events: {events.count()}, done: {events.filter(status=StripeEvent.DONE).count()}, '
+            f'orders: {orders.count()} for {len(pids)} payments, errors: {len(errors)}'
+        )
+
+        if not options['keep']:
+            events.delete()
+            orders.delete()
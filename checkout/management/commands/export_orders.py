@@ -0,0 +1,54 @@
+import time
+from datetime import datetime, time as day_start
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from checkout.exports import CHUNK_SIZE, EXPORT_FORMATS, export_orders
+from checkout.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Export orders with their line items as CSV or JSON, to a file or '
+        'standard output. Orders are read a chunk at a time, so any number '
+        'of orders can be exported in the same amount of memory.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since',
+                            help='Only export orders placed on or after this date or date and time, '
+                                 'e.g. 2024-01-31 or 2024-01-31T12:00')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--output', help='File to write to, standard output by default')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['since']:
+            orders = orders.filter(date__gte=self.since(options['since']))
+
+        pieces = export_orders(orders, options['format'], options['chunk_size'])
+        if not options['output']:
+            for piece in pieces:
+                self.stdout.write(piece, ending='')
+            return
+
+        start = time.perf_counter()
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for piece in pieces:
+                output.write(piece)
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported orders to {options["output"]} in {time.perf_counter() - start:.1f}s'))
+
+    def since(self, value):
+        since = parse_datetime(value)
+        if since is None:
+            date = parse_date(value)
+            if date is None:
+                raise CommandError(f'--since must be a date or date and time, not {value!r}')
+            since = datetime.combine(date, day_start())
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
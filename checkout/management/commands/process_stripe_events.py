@@ -0,0 +1,55 @@
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from checkout.event_queue import claim_events, process_event
+from checkout.models import StripeEvent
+
+
+class Command(BaseCommand):
+    help = 'Work through the queue of Stripe webhook events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Number of events to handle at the same time')
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Number of events to claim at a time')
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once there are no more events due')
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            while True:
+                claimed = claim_events(options['batch_size'])
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                for stripe_event in executor.map(self.process, claimed):
+                    if stripe_event is not None:
+                        self.report(stripe_event)
+
+    def process(self, pk):
+        try:
+            return process_event(pk)
+        except Exception:
+            # Keep the worker going, the event is picked up again once its claim runs out
+            self.stderr.write(f'Event {pk} could not be processed:\n{traceback.format_exc()}')
+            return None
+        finally:
+            # Each thread has its own connection, don't leave it open
+            connection.close()
+
+    def report(self, stripe_event):
+        message = f'{stripe_event.event_id} ({stripe_event.event_type}): {stripe_event.status}'
+        if stripe_event.status == StripeEvent.DONE:
+            self.stdout.write(self.style.SUCCESS(message))
+        else:
+            self.stdout.write(self.style.WARNING(f'{message} after {stripe_event.attempts} attempts'))
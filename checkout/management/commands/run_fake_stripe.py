@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from checkout.stripe_fakes import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a fake Stripe API for load testing the checkout offline. '
+        'Start the site with STRIPE_API_BASE set to the url it prints.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency', type=float, default=0,
+                            help='Seconds to wait before answering each call, like the round trip to Stripe')
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(options['port'], options['latency'])
+        self.stdout.write(self.style.SUCCESS(f'Fake Stripe API listening, STRIPE_API_BASE={server.url}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
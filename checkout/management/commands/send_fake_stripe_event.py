@@ -0,0 +1,55 @@
+import json
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from checkout.stripe_fakes import fake_payment_intent_payload, sign_payload
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Send a signed, fake payment_intent.succeeded event to a running '
+        'webhook endpoint, or print it with --print.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/checkout/wh/',
+                            help='The webhook endpoint to post to')
+        parser.add_argument('--count', type=int, default=1,
+                            help='Number of events to send')
+        parser.add_argument('--duplicate', action='store_true',
+                            help='Send every event twice, like a Stripe retry')
+        parser.add_argument('--username', default='AnonymousUser')
+        parser.add_argument('--print', action='store_true',
+                            help="Print the payload and signature instead of sending them")
+
+    def handle(self, *args, **options):
+        if not settings.STRIPE_WH_SECRET:
+            raise CommandError('STRIPE_WH_SECRET needs to be set to sign the events.')
+        product_ids = list(Product.objects.values_list('id', flat=True)[:3])
+        if not product_ids:
+            raise CommandError('Load some products first.')
+        bag = {str(product_id): 1 for product_id in product_ids}
+
+        for _ in range(options['count']):
+            payload = json.dumps(fake_payment_intent_payload(bag, username=options['username']))
+            signature = sign_payload(payload, settings.STRIPE_WH_SECRET)
+            if options['print']:
+                self.stdout.write(f'Stripe-Signature: {signature}\n{payload}')
+                continue
+            for _ in range(2 if options['duplicate'] else 1):
+                self.send(options['url'], payload, signature)
+
+    def send(self, url, payload, signature):
+        request = Request(url, data=payload.encode('utf-8'), headers={
+            'Content-Type': 'application/json',
+            'Stripe-Signature': signature,
+        })
+        try:
+            with urlopen(request, timeout=10) as response:
+                self.stdout.write(f'{response.status}: {response.read().decode("utf-8")}')
+        except HTTPError as e:
+            self.stdout.write(self.style.ERROR(f'{e.code}: {e.read().decode("utf-8")}'))
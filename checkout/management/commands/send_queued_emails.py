@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkout.mail_queue import send_queued_emails
+from checkout.models import QueuedEmail
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails in batches over a single mail server connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Number of emails to send per connection')
+        parser.add_argument('--poll-interval', type=float, default=5,
+                            help='Seconds to wait when there is nothing to send')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once there are no more emails due')
+        parser.add_argument('--backend',
+                            help='Email backend to use instead of EMAIL_BACKEND, '
+                                 'e.g. django.core.mail.backends.locmem.EmailBackend')
+
+    def handle(self, *args, **options):
+        while True:
+            emails = send_queued_emails(options['batch_size'], backend=options['backend'])
+            if not emails:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            for email in emails:
+                if email.status == QueuedEmail.SENT:
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Sent "{email.subject}" to {email.to} in {email.send_latency_ms:.1f}ms'))
+                else:
+                    self.stdout.write(self.style.WARNING(
+                        f'Failed "{email.subject}" to {email.to} '
+                        f'(attempt {email.attempts}): {email.last_error}'))
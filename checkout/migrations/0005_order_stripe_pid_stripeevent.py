@@ -0,0 +1,56 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:08
+
+import logging
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+logger = logging.getLogger(__name__)
+
+
+def mark_duplicate_orders(apps, schema_editor):
+    """
+    The old webhook could create an order a second time for the same
+    payment intent. Keep the first order for each payment intent and
+    give the others a stripe_pid ending in :duplicate:<pk>, so nothing
+    is deleted and the duplicates are easy to find in the admin.
+    """
+    Order = apps.get_model('checkout', 'Order')
+    duplicated = (Order.objects.exclude(stripe_pid='').values('stripe_pid')
+                  .annotate(orders=Count('pk')).filter(orders__gt=1).values_list('stripe_pid', flat=True))
+    for stripe_pid in duplicated:
+        orders = Order.objects.filter(stripe_pid=stripe_pid).order_by('pk')
+        kept, *duplicates = orders.values_list('pk', 'order_number')
+        for pk, order_number in duplicates:
+            Order.objects.filter(pk=pk).update(stripe_pid=f'{stripe_pid}:duplicate:{pk}')
+            logger.warning('Order %s duplicates order %s for payment %s', order_number, kept[1], stripe_pid)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0004_order_user_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('event_type', models.CharField(max_length=100)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(mark_duplicate_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('stripe_pid', ''), _negated=True), fields=('stripe_pid',), name='unique_order_stripe_pid'),
+        ),
+        migrations.AddField(
+            model_name='stripeevent',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stripe_events', to='checkout.order'),
+        ),
+    ]
@@ -1,8 +1,9 @@
 import uuid
 
 from django.db import models
-from django.db.models import Sum
+from django.db.models import Q, Sum
 from django.conf import settings
+from django.utils import timezone
 
 from django_countries.fields import CountryField
 
@@ -11,7 +12,24 @@ from profiles.models import UserProfile
 
 
 class Order(models.Model):
-    order_number = models.CharField(max_length=32, null=False, editable=False)
+
+    class Meta:
+        constraints = [
+            # Each payment intent belongs to exactly one order. This lets the
+            # webhook find the order with a single indexed lookup, and makes the
+            # database settle a race between the webhook and the web checkout.
+            models.UniqueConstraint(
+                fields=['stripe_pid'],
+                condition=~Q(stripe_pid=''),
+                name='unique_order_stripe_pid',
+            ),
+        ]
+        indexes = [
+            # A user's order history, newest first, on the profile page
+            models.Index(fields=['user_profile', '-date'], name='order_profile_date_idx'),
+        ]
+
+    order_number = models.CharField(max_length=32, null=False, editable=False, unique=True)
     user_profile = models.ForeignKey(UserProfile, on_delete=models.SET_NULL,
                                      null=True, blank=True, related_name='orders')
     full_name = models.CharField(max_length=50, null=False, blank=False)
@@ -23,12 +41,12 @@ class Order(models.Model):
     street_address1 = models.CharField(max_length=80, null=False, blank=False)
     street_address2 = models.CharField(max_length=80, null=True, blank=True)
     county = models.CharField(max_length=80, null=True, blank=True)
-    date = models.DateTimeField(auto_now_add=True)
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
     delivery_cost = models.DecimalField(max_digits=6, decimal_places=2, null=False, default=0)
     order_total = models.DecimalField(max_digits=10, decimal_places=2, null=False, default=0)
     grand_total = models.DecimalField(max_digits=10, decimal_places=2, null=False, default=0)
     original_bag = models.TextField(null=False, blank=False, default='')
-    stripe_pid = models.CharField(max_length=254, null=False, blank=False, default='')
+    stripe_pid = models.CharField(max_length=254, null=False, blank=False, default='', db_index=True)
 
     def _generate_order_number(self):   # prepended with an underscore by convention to indicate it's a private method which will only be used inside this class.
         """ 
@@ -47,13 +65,20 @@ class Order(models.Model):
         using the free delivery threshold and the standard delivery percentage from our settings file.
         Setting it to zero if the order total is higher than the threshold. And then to calculate the grand total
         """
-        self.order_total = self.lineitems.aggregate(Sum('lineitem_total'))['lineitem_total__sum'] or 0
+        self.set_totals(self.lineitems.aggregate(Sum('lineitem_total'))['lineitem_total__sum'] or 0)
+        self.save()
+
+    def set_totals(self, order_total):
+        """
+        Set the order total, delivery cost and grand total
+        from the sum of the line item totals, without saving.
+        """
+        self.order_total = order_total
         if self.order_total < settings.FREE_DELIVERY_TRESHOLD:
             self.delivery_cost = self.order_total * settings.STANDARD_DELIVERY_PERCENTAGE / 100
         else:
             self.delivery_cost = 0
         self.grand_total = self.order_total + self.delivery_cost
-        self.save()
 
     def save(self, *args, **kwargs):
         """ 
@@ -85,3 +110,79 @@ class OrderLineItem(models.Model):
 
     def __str__(self):
         return f'SKU {self.product.sku} on order {self.order.order_number}'
+
+
+class StripeEvent(models.Model):
+    """
+    The inbox of Stripe webhook events.
+    The webhook only verifies and stores each event here, and the
+    process_stripe_events command works through them in the background.
+    The unique event id means duplicate deliveries are only stored once.
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='stripe_event_due_idx'),
+        ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.TextField(blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # When the event can next be picked up by a worker
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.SET_NULL, related_name='stripe_events')
+    created = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.event_id
+
+
+class QueuedEmail(models.Model):
+    """
+    An email waiting to be sent by the send_queued_emails command,
+    so sending it doesn't hold up the request or webhook that created it
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='queued_email_due_idx'),
+        ]
+
+    subject = models.CharField(max_length=254)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    # Comma separated list of recipients
+    to = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # When the email can next be picked up for sending
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    send_latency_ms = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.subject} to {self.to}'
@@ -0,0 +1,51 @@
+from django.db import transaction
+
+from bag.utils import get_bag_products
+from products.models import Product
+
+from .models import OrderLineItem
+
+
+def build_order(order, bag):
+    """
+    Save an order together with a line item for everything in the bag.
+
+    All products are fetched with a single query, the line items are
+    created with one bulk insert and the order totals are worked out
+    here, so the order is only saved once. Everything happens in one
+    transaction, so a product that no longer exists raises
+    Product.DoesNotExist and leaves nothing behind in the database.
+    """
+    with transaction.atomic():
+        products = get_bag_products(bag)
+        line_items = []
+        for item_id, item_data in bag.items():
+            product = products.get(str(item_id))
+            if product is None:
+                raise Product.DoesNotExist(
+                    f'Product {item_id} in the bag no longer exists')
+
+            if isinstance(item_data, int):
+                quantities = [(None, item_data)]
+            else:
+                quantities = item_data['items_by_size'].items()
+
+            for size, quantity in quantities:
+                # bulk_create doesn't call OrderLineItem.save(),
+                # so the line item total is set here instead
+                line_items.append(OrderLineItem(
+                    order=order,
+                    product=product,
+                    quantity=quantity,
+                    product_size=size,
+                    lineitem_total=product.price * quantity,
+                ))
+
+        # bulk_create doesn't send post_save, so the line item signals never
+        # update the order total. Setting the totals here is the only thing
+        # that keeps them right.
+        order.set_totals(sum(item.lineitem_total for item in line_items))
+        order.save()
+        OrderLineItem.objects.bulk_create(line_items)
+
+    return order
@@ -0,0 +1,136 @@
+"""
+The payments gateway. All calls to the Stripe API go through here.
+
+One StripeClient is shared by the whole process, plus one for each
+other timeout asked for. Their HTTP clients keep a requests session per
+thread, so the connection to Stripe is reused between calls rather than
+set up again for each one. Every call has a timeout, network errors are retried with the same idempotency key,
+and every call is timed for call_stats() and the performance
+middleware.
+
+Setting STRIPE_API_BASE sends the calls to another server instead of
+api.stripe.com, like the fake one in checkout/stripe_fakes.py.
+"""
+import json
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from boutique_ado.benchmarking import percentile
+from boutique_ado.performance import timed
+
+import stripe
+
+# How many of the latest latencies of each call are kept for the percentiles
+LATENCY_SAMPLES = 1000
+
+
+class CallStats:
+    """Counts, errors and recent latencies of each kind of Stripe call"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLES))
+
+    def record(self, call, elapsed, failed):
+        with self.lock:
+            self.counts[call] += 1
+            if failed:
+                self.errors[call] += 1
+            self.latencies[call].append(elapsed * 1000)
+
+    def summary(self):
+        with self.lock:
+            summary = {}
+            for call, latencies in self.latencies.items():
+                latencies = sorted(latencies)
+                summary[call] = {
+                    'count': self.counts[call],
+                    'errors': self.errors[call],
+                    'p50_ms': statistics.median(latencies),
+                    'p95_ms': percentile(latencies, 95),
+                    'max_ms': latencies[-1],
+                }
+            return summary
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+            self.errors.clear()
+            self.latencies.clear()
+
+
+stats = CallStats()
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(timeout=None):
+    """
+    The StripeClient for the current settings and this timeout in seconds,
+    STRIPE_API_TIMEOUT by default. Each is made once and shared, so calls
+    with a shorter timeout get a client of their own.
+    """
+    timeout = timeout or settings.STRIPE_API_TIMEOUT
+    key = (settings.STRIPE_SECRET_KEY, getattr(settings, 'STRIPE_API_BASE', None), timeout)
+    with _clients_lock:
+        if key not in _clients:
+            base_addresses = {'api': key[1]} if key[1] else {}
+            _clients[key] = stripe.StripeClient(
+                key[0] or '', http_client=stripe.http_client.RequestsClient(timeout=timeout),
+                base_addresses=base_addresses, max_network_retries=settings.STRIPE_API_MAX_RETRIES,
+            )
+        return _clients[key]
+
+
+@contextmanager
+def _call(name, timeout):
+    client = get_client(timeout)
+    start = time.perf_counter()
+    failed = True
+    try:
+        with timed():
+            yield client
+        failed = False
+    finally:
+        stats.record(name, time.perf_counter() - start, failed)
+
+
+def create_payment_intent(amount, currency, timeout=None, **params):
+    with _call('payment_intents.create', timeout) as client:
+        return client.payment_intents.create(params={'amount': amount, 'currency': currency, **params})
+
+
+def modify_payment_intent(pid, timeout=None, **params):
+    with _call('payment_intents.update', timeout) as client:
+        return client.payment_intents.update(pid, params=params)
+
+
+def retrieve_payment_intent(pid, timeout=None):
+    with _call('payment_intents.retrieve', timeout) as client:
+        return client.payment_intents.retrieve(pid)
+
+
+def retrieve_charge(charge_id, timeout=None):
+    with _call('charges.retrieve', timeout) as client:
+        return client.charges.retrieve(charge_id)
+
+
+def event_from_payload(payload):
+    """
+    A Stripe event from the JSON it was delivered as. Nothing is fetched,
+    and the event has no API key, so any calls it needs go through here.
+    """
+    return stripe.Event.construct_from(json.loads(payload), None)
+
+
+def call_stats():
+    """Count, errors and p50/p95/max latency of each kind of call made so far"""
+    return stats.summary()
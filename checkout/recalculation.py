@@ -0,0 +1,44 @@
+from django.db import transaction
+
+
+class TotalUpdates:
+    """
+    The orders to recalculate once the current transaction commits.
+    It's registered with on_commit, so if the transaction (or the
+    savepoint it was registered in) is rolled back, Django throws it
+    away together with the changes that scheduled it.
+    """
+
+    def __init__(self):
+        self.order_ids = set()
+
+    def __call__(self):
+        from .models import Order
+
+        for order in Order.objects.filter(pk__in=self.order_ids):
+            order.update_total()
+
+
+def schedule_total_update(order_id):
+    """
+    Mark an order as needing its totals recalculated.
+    The recalculation runs once the current transaction commits
+    (or straight away outside of a transaction), so an order whose
+    line items are changed many times is only recalculated once.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        updates = TotalUpdates()
+        updates.order_ids.add(order_id)
+        updates()
+        return
+
+    # One set of updates per transaction, found among its on_commit callbacks
+    for savepoint_ids, callback in connection.run_on_commit:
+        if isinstance(callback, TotalUpdates):
+            updates = callback
+            break
+    else:
+        updates = TotalUpdates()
+        transaction.on_commit(updates)
+    updates.order_ids.add(order_id)
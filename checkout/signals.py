@@ -13,6 +13,7 @@ from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
 from .models import OrderLineItem
+from .recalculation import schedule_total_update
 
 
 @receiver(post_save, sender=OrderLineItem)
@@ -30,8 +31,11 @@ def update_on_save(sender, instance, created, **kwargs):
     ---
     we just have to access instance.order which refers to the order this specific line item is related to.
     And call the update_total method on it. 
+    ---
+    The recalculation is deferred until the transaction commits,
+    so editing several line items at once only updates the order once.
     """
-    instance.order.update_total()
+    schedule_total_update(instance.order_id)
 
 
 @receiver(post_delete, sender=OrderLineItem)
@@ -41,7 +45,7 @@ def update_on_delete(sender, instance, **kwargs):
     ---
     Has no created
     """
-    instance.order.update_total()
+    schedule_total_update(instance.order_id)
 
 """
 And now to let django know that there's a new signals module with some listeners in it.
@@ -0,0 +1,206 @@
+"""
+Fake Stripe payloads for exercising the webhook code locally, and a
+fake Stripe API server for the checkout, without a Stripe account or
+network access.
+"""
+import hashlib
+import hmac
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import stripe
+
+
+def fake_payment_intent_payload(bag, pid=None, event_id=None, amount=0,
+                                username='AnonymousUser', save_info=False,
+                                email='customer@example.com'):
+    """
+    Build a payment_intent.succeeded event as Stripe would send it.
+    The charge is included already expanded, so handling the event
+    doesn't need to call the Stripe API.
+    """
+    pid = pid or f'pi_fake_{uuid.uuid4().hex[:24]}'
+    event_id = event_id or f'evt_fake_{uuid.uuid4().hex[:24]}'
+    address = {
+        'line1': '1 Fake Street',
+        'line2': '',
+        'city': 'Dublin',
+        'state': '',
+        'postal_code': 'D01 F4K3',
+        'country': 'IE',
+    }
+    return {
+        'id': event_id,
+        'object': 'event',
+        'type': 'payment_intent.succeeded',
+        'data': {
+            'object': {
+                'id': pid,
+                'object': 'payment_intent',
+                'amount': amount,
+                'metadata': {
+                    'bag': json.dumps(bag),
+                    'save_info': 'true' if save_info else '',
+                    'username': username,
+                },
+                'shipping': {
+                    'name': 'Fake Customer',
+                    'phone': '0123456789',
+                    'address': address,
+                },
+                'latest_charge': {
+                    'id': f'ch_fake_{uuid.uuid4().hex[:24]}',
+                    'object': 'charge',
+                    'amount': amount,
+                    'billing_details': {
+                        'email': email,
+                        'name': 'Fake Customer',
+                        'phone': '0123456789',
+                        'address': address,
+                    },
+                },
+            },
+        },
+    }
+
+
+def fake_event(payload):
+    """Turn a fake payload into a stripe.Event, like construct_event does"""
+    return stripe.Event.construct_from(payload, stripe.api_key)
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """
+    Return a Stripe-Signature header for the payload,
+    which stripe.Webhook.construct_event will accept.
+    """
+    timestamp = timestamp or int(time.time())
+    signed_payload = f'{timestamp}.{payload}'
+    signature = hmac.new(secret.encode('utf-8'), signed_payload.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+def _parse_form(body):
+    """Parse a form encoded Stripe request, where metadata[bag]=... is a nested value"""
+    params = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        match = re.fullmatch(r'(\w+)\[(\w+)\]', key)
+        if match:
+            params.setdefault(match[1], {})[match[2]] = value
+        else:
+            params[key] = int(value) if key == 'amount' else value
+    return params
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    """
+    Answers the few Stripe API calls the shop makes:
+    creating, updating and retrieving payment intents, and retrieving charges
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.handle_call('GET')
+
+    def do_POST(self):
+        self.handle_call('POST')
+
+    def handle_call(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = _parse_form(self.rfile.read(length).decode('utf-8'))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        path = self.path.split('?')[0]
+        intents = self.server.payment_intents
+        with self.server.lock:
+            self.server.calls.append((method, path))
+            if method == 'POST' and path == '/v1/payment_intents':
+                pid = f'pi_fake_{uuid.uuid4().hex[:24]}'
+                intents[pid] = {
+                    'id': pid,
+                    'object': 'payment_intent',
+                    'amount': 0,
+                    'currency': 'usd',
+                    'client_secret': f'{pid}_secret_{uuid.uuid4().hex[:24]}',
+                    'status': 'requires_payment_method',
+                    'metadata': {},
+                }
+                intents[pid].update(params)
+                return self.send_json(200, intents[pid])
+
+            match = re.fullmatch(r'/v1/payment_intents/(\w+)', path)
+            if match and match[1] in intents:
+                intent = intents[match[1]]
+                if method == 'POST':
+                    intent['metadata'].update(params.pop('metadata', {}))
+                    intent.update(params)
+                return self.send_json(200, intent)
+
+            match = re.fullmatch(r'/v1/charges/(\w+)', path)
+            if match and method == 'GET':
+                payload = fake_payment_intent_payload({})
+                return self.send_json(200, dict(payload['data']['object']['latest_charge'], id=match[1]))
+
+        self.send_json(404, {'error': {
+            'type': 'invalid_request_error',
+            'message': f'Unrecognized request URL ({method}: {path})',
+        }})
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Request-Id', f'req_fake_{uuid.uuid4().hex[:14]}')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    """
+    A fake Stripe API running in a thread of this process.
+    Point STRIPE_API_BASE at its url to use it instead of Stripe:
+
+        with FakeStripeServer() as server, override_settings(STRIPE_API_BASE=server.url):
+            ...
+
+    `latency` adds a delay to every call, like the round trip to Stripe.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0):
+        super().__init__(('127.0.0.1', port), FakeStripeHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.payment_intents = {}
+        self.calls = []
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def handle_error(self, request, client_address):
+        # Callers that timed out have hung up before the answer is sent
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
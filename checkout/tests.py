@@ -1,3 +1,338 @@
-from django.test import TestCase
+import csv
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from boutique_ado.testing import QueryBudgetMixin
+from products.models import Product
+
+from . import payments
+from .event_queue import claim_events, enqueue_event, process_event
+from .mail_queue import queue_email, send_queued_emails
+from .models import Order, OrderLineItem, QueuedEmail, StripeEvent
+from .order_builder import build_order
+from .stripe_fakes import FakeStripeServer, fake_payment_intent_payload
+
+import stripe
+
+
+class ExportOrdersTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(sku='sku1', name='Jeans', description='Blue', price=10)
+        cls.orders = []
+        for days_ago in (10, 1):
+            order = Order.objects.create(
+                full_name='Test Customer', email='customer@example.com', phone_number='0123456789',
+                country='IE', town_or_city='Dublin', street_address1='1 Fake Street')
+            Order.objects.filter(pk=order.pk).update(date=timezone.now() - timedelta(days=days_ago))
+            OrderLineItem.objects.create(order=order, product=product, quantity=2)
+            cls.orders.append(order)
+        Order.objects.create(
+            full_name='No Items', email='customer@example.com', phone_number='0123456789',
+            country='IE', town_or_city='Dublin', street_address1='1 Fake Street')
+
+    def test_admin_action_streams_csv(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.post(reverse('admin:checkout_order_changelist'), {
+            'action': 'export_as_csv',
+            '_selected_action': [order.pk for order in Order.objects.all()],
+        })
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual((rows[0]['sku'], rows[0]['quantity'], rows[0]['lineitem_total']), ('sku1', '2', '20.00'))
+        self.assertEqual(rows[2]['full_name'], 'No Items')
+        self.assertEqual(rows[2]['sku'], '')
+
+    def test_command_exports_orders_since(self):
+        output = StringIO()
+        since = (timezone.now() - timedelta(days=2)).date().isoformat()
+        # A chunk size of 1 checks line items end up with the right order across chunks
+        call_command('export_orders', since=since, format='json', chunk_size=1, stdout=output)
+        orders = json.loads(output.getvalue())
+        self.assertEqual([order['order_number'] for order in orders],
+                         [self.orders[1].order_number, Order.objects.get(full_name='No Items').order_number])
+        self.assertEqual(orders[0]['lineitems'][0]['product'], 'Jeans')
+        self.assertEqual(orders[1]['lineitems'], [])
+
+
+class PaymentsGatewayTests(TestCase):
+
+    def setUp(self):
+        self.server = FakeStripeServer().start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        settings_override = override_settings(
+            STRIPE_API_BASE=self.server.url, STRIPE_SECRET_KEY='sk_test_fake', STRIPE_API_MAX_RETRIES=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        payments.stats.reset()
+
+    def test_checkout_page_creates_payment_intent(self):
+        product = Product.objects.create(sku='sku1', name='Jeans', description='Blue', price=10)
+        self.client.post(reverse('api_add_to_bag', args=[product.pk]), {'quantity': 2})
+        response = self.client.get(reverse('checkout'))
+
+        [intent] = self.server.payment_intents.values()
+        self.assertEqual(response.context['client_secret'], intent['client_secret'])
+        self.assertEqual(intent['amount'], 2000 + round(2000 * settings.STANDARD_DELIVERY_PERCENTAGE / 100))
+        self.assertEqual(payments.call_stats()['payment_intents.create']['count'], 1)
+
+        payments.modify_payment_intent(intent['id'], metadata={'bag': '{}'})
+        self.assertEqual(self.server.payment_intents[intent['id']]['metadata'], {'bag': '{}'})
+
+    def test_payment_intent_reused_on_reload(self):
+        product = Product.objects.create(sku='sku1', name='Jeans', description='Blue', price=10)
+        self.client.post(reverse('api_add_to_bag', args=[product.pk]), {'quantity': 1})
+        first = self.client.get(reverse('checkout')).context['client_secret']
+        self.assertEqual(self.client.get(reverse('checkout')).context['client_secret'], first)
+        self.assertEqual(len(self.server.calls), 1)
+
+        # A new total updates the same intent
+        self.client.post(reverse('api_adjust_bag', args=[product.pk]), {'quantity': 3})
+        self.assertEqual(self.client.get(reverse('checkout')).context['client_secret'], first)
+        [intent] = self.server.payment_intents.values()
+        self.assertEqual(intent['amount'], 3000 + round(3000 * settings.STANDARD_DELIVERY_PERCENTAGE / 100))
+        self.assertEqual([method for method, path in self.server.calls], ['POST', 'POST'])
+
+        # Once the payment may have been confirmed, Stripe is asked whether it went through
+        self.client.post(reverse('cache_checkout_data'), {'client_secret': first})
+        self.assertEqual(self.client.get(reverse('checkout')).context['client_secret'], first)
+        self.assertEqual([method for method, path in self.server.calls], ['POST', 'POST', 'POST', 'GET'])
+
+        # An intent that's been paid isn't handed out again, even before its order exists
+        self.client.post(reverse('cache_checkout_data'), {'client_secret': first})
+        intent['status'] = 'succeeded'
+        second = self.client.get(reverse('checkout')).context['client_secret']
+        self.assertNotEqual(second, first)
+        self.assertEqual(len(self.server.payment_intents), 2)
+        [intent] = [intent for intent in self.server.payment_intents.values() if intent['client_secret'] == second]
+
+        # Once the intent has paid for an order, the next checkout gets a new one
+        order = Order.objects.create(
+            full_name='Test Customer', email='customer@example.com', phone_number='0123456789',
+            country='IE', town_or_city='Dublin', street_address1='1 Fake Street', stripe_pid=intent['id'])
+        self.client.get(reverse('checkout_success', args=[order.order_number]))
+        self.client.post(reverse('api_add_to_bag', args=[product.pk]), {'quantity': 1})
+        self.assertNotIn(self.client.get(reverse('checkout')).context['client_secret'], (first, second))
+        self.assertEqual(len(self.server.payment_intents), 3)
+
+    def test_timeout(self):
+        self.server.latency = 0.5
+        with self.assertRaises(stripe.APIConnectionError):
+            payments.retrieve_charge('ch_fake', timeout=0.1)
+        self.assertEqual(payments.call_stats()['charges.retrieve']['errors'], 1)
+
+
+class StripeEventTests(TestCase):
+
+    def setUp(self):
+        self.server = FakeStripeServer().start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        settings_override = override_settings(
+            STRIPE_API_BASE=self.server.url, STRIPE_SECRET_KEY='sk_test_fake',
+            STRIPE_API_MAX_RETRIES=0, STRIPE_API_TIMEOUT=0.1, DEFAULT_FROM_EMAIL='shop@example.com')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        product = Product.objects.create(sku='sku1', name='Jeans', description='Blue', price=10)
+        self.bag = {str(product.pk): 1}
+        payments.stats.reset()
+
+    def enqueue(self, **kwargs):
+        payload = fake_payment_intent_payload(self.bag, **kwargs)
+        enqueue_event(payload, json.dumps(payload))
+        return payload['data']['object']['id']
+
+    def process_due_events(self):
+        StripeEvent.objects.update(available_at=timezone.now())
+        return [process_event(pk) for pk in claim_events(10)]
+
+    def test_failed_event_is_retried(self):
+        payload = fake_payment_intent_payload(self.bag)
+        # Only the charge id, so the handler has to fetch the charge
+        payload['data']['object']['latest_charge'] = 'ch_fake'
+        enqueue_event(payload, json.dumps(payload))
+
+        self.server.latency = 0.5
+        [stripe_event] = self.process_due_events()
+        self.assertEqual(stripe_event.status, StripeEvent.PENDING)
+        self.assertIn('Timeout', stripe_event.last_error)
+        self.assertFalse(Order.objects.exists())
+
+        self.server.latency = 0
+        [stripe_event] = self.process_due_events()
+        self.assertEqual(stripe_event.status, StripeEvent.DONE)
+        self.assertEqual(payments.call_stats()['charges.retrieve']['count'], 2)
+        stripe_event.refresh_from_db()
+        self.assertEqual(stripe_event.order.stripe_pid, payload['data']['object']['id'])
+
+    def test_order_created_without_profile(self):
+        pid = self.enqueue(username='deleted-user')
+        [stripe_event] = self.process_due_events()
+        self.assertEqual(stripe_event.status, StripeEvent.DONE)
+        self.assertIsNone(Order.objects.get(stripe_pid=pid).user_profile)
+
+
+
+@override_settings(DEFAULT_FROM_EMAIL='shop@example.com')
+class ProcessStripeEventsTests(TransactionTestCase):
+    # The worker handles events in other threads, which only see committed data
+
+    def test_worker_keeps_going_after_an_error(self):
+        product = Product.objects.create(sku='sku1', name='Jeans', description='Blue', price=10)
+        payloads = [fake_payment_intent_payload({str(product.pk): 1}) for _ in range(2)]
+        for payload in payloads:
+            enqueue_event(payload, json.dumps(payload))
+        failing = StripeEvent.objects.get(event_id=payloads[0]['id']).pk
+
+        def process_event_failing_once(pk):
+            if pk == failing:
+                raise RuntimeError('Database went away')
+            return process_event(pk)
+
+        stderr = StringIO()
+        with mock.patch('checkout.management.commands.process_stripe_events.process_event',
+                        process_event_failing_once):
+            call_command('process_stripe_events', once=True, stdout=StringIO(), stderr=stderr)
+        self.assertIn('Database went away', stderr.getvalue())
+        self.assertTrue(Order.objects.filter(stripe_pid=payloads[1]['data']['object']['id']).exists())
+        # Left claimed, to be picked up again once the claim runs out
+        self.assertEqual(StripeEvent.objects.get(pk=failing).status, StripeEvent.PROCESSING)
+
+
+class OrderTotalTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(sku='sku1', name='Jeans', description='Blue', price=10)
+
+    def create_order(self):
+        return Order.objects.create(
+            full_name='Test Customer', email='customer@example.com', phone_number='0123456789',
+            country='IE', town_or_city='Dublin', street_address1='1 Fake Street')
+
+    def order_updates(self, context):
+        return [query for query in context.captured_queries if query['sql'].startswith('UPDATE "checkout_order"')]
+
+    def test_line_item_saves_update_totals_once(self):
+        order = self.create_order()
+        with CaptureQueriesContext(connection) as context, self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for quantity in range(1, 6):
+                    OrderLineItem.objects.create(order=order, product=self.product, quantity=quantity)
+        self.assertEqual(len(self.order_updates(context)), 1)
+
+        order.refresh_from_db()
+        self.assertEqual(order.order_total, 150)
+        self.assertEqual(order.grand_total, order.order_total + order.delivery_cost)
+
+    def test_rolled_back_changes_are_not_recalculated(self):
+        rolled_back, committed = self.create_order(), self.create_order()
+        with CaptureQueriesContext(connection) as context, self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    OrderLineItem.objects.create(order=rolled_back, product=self.product, quantity=1)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            with transaction.atomic():
+                OrderLineItem.objects.create(order=committed, product=self.product, quantity=2)
+        [update] = self.order_updates(context)
+        self.assertIn(f'"id" = {committed.pk}', update['sql'])
+        committed.refresh_from_db()
+        self.assertEqual(committed.order_total, 20)
+
+
+class CountingEmailBackend(EmailBackend):
+    """The locmem backend, counting connections and failing to send to one address"""
+    connections = 0
+    failing_address = 'bounce@example.com'
+
+    def open(self):
+        CountingEmailBackend.connections += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        if any(self.failing_address in message.to for message in messages):
+            raise ConnectionResetError('Mail server hung up')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_QUEUE_RETRY_DELAY=60)
+class MailQueueTests(TestCase):
+    backend = 'checkout.tests.CountingEmailBackend'
+
+    def setUp(self):
+        CountingEmailBackend.connections = 0
+        CountingEmailBackend.failing_address = 'bounce@example.com'
+
+    def test_batch_sent_over_one_connection(self):
+        for number in range(3):
+            queue_email(f'Order {number}\n', 'Thanks', 'shop@example.com', [f'customer{number}@example.com'])
+        emails = send_queued_emails(backend=self.backend)
+
+        self.assertEqual(CountingEmailBackend.connections, 1)
+        self.assertEqual([email.status for email in emails], [QueuedEmail.SENT] * 3)
+        self.assertEqual([message.subject for message in mail.outbox], ['Order 0', 'Order 1', 'Order 2'])
+
+    def test_failed_send_is_retried_with_backoff(self):
+        queue_email('Order', 'Thanks', 'shop@example.com', [CountingEmailBackend.failing_address])
+        send_queued_emails(backend=self.backend)
+        email = QueuedEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (QueuedEmail.PENDING, 1))
+        self.assertIn('Mail server hung up', email.last_error)
+        self.assertGreater(email.available_at, timezone.now() + timedelta(seconds=50))
+        # Not due again until the backoff has passed
+        self.assertEqual(send_queued_emails(backend=self.backend), [])
+
+        CountingEmailBackend.failing_address = 'nobody'
+        QueuedEmail.objects.update(available_at=timezone.now())
+        [email] = send_queued_emails(backend=self.backend)
+        self.assertEqual((email.status, email.attempts), (QueuedEmail.SENT, 2))
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class BuildOrderTests(QueryBudgetMixin, TestCase):
+
+    def new_order(self):
+        return Order(
+            full_name='Test Customer', email='customer@example.com', phone_number='0123456789',
+            country='IE', town_or_city='Dublin', street_address1='1 Fake Street')
+
+    def test_order_built_in_few_queries(self):
+        jeans = Product.objects.create(sku='jeans', name='Jeans', description='Blue', price=10)
+        shirt = Product.objects.create(sku='shirt', name='Shirt', description='White', price=25, has_sizes=True)
+        bag = {str(jeans.pk): 3, str(shirt.pk): {'items_by_size': {'m': 1, 'l': 2}}}
+        # The products, the order and all its line items in one insert
+        with self.assertMaxQueries(3):
+            order = build_order(self.new_order(), bag)
+
+        lines = order.lineitems.order_by('pk')
+        self.assertEqual([(line.product_size, line.lineitem_total) for line in lines],
+                         [(None, 30), ('m', 25), ('l', 50)])
+        order.refresh_from_db()
+        self.assertEqual(order.order_total, 105)
+        self.assertEqual(order.grand_total, order.order_total + order.delivery_cost)
+
+    def test_missing_product_leaves_nothing_behind(self):
+        jeans = Product.objects.create(sku='jeans', name='Jeans', description='Blue', price=10)
+        with self.assertRaises(Product.DoesNotExist):
+            build_order(self.new_order(), {str(jeans.pk): 1, '9999': 1})
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderLineItem.objects.exists())
@@ -2,29 +2,99 @@ from django.shortcuts import render, redirect, reverse, get_object_or_404, HttpR
 from django.views.decorators.http import require_POST
 from django.contrib import messages
 from django.conf import settings
+from django.db import IntegrityError
 
+from . import payments
 from .forms import OrderForm
-from .models import Order, OrderLineItem
+from .models import Order
+from .order_builder import build_order
 
 from products.models import Product
 from profiles.models import UserProfile
 from profiles.forms import UserProfileForm
-from bag.contexts import bag_contents
+from profiles.utils import get_user_profile
+from bag.utils import clear_cart, get_bag
 
-import stripe
 import json
+import stripe
+
+
+# Where the checkout's payment intent is kept in the session
+PAYMENT_INTENT_SESSION_KEY = 'payment_intent'
+
+# Intents in these states haven't been paid yet, so they can be used again
+REUSABLE_INTENT_STATUSES = ('requires_payment_method', 'requires_confirmation')
+
+
+def _stored_intent_usable(stored):
+    """
+    Whether the intent in the session can be used again. Stripe is only
+    asked once the intent may have been confirmed, i.e. after
+    cache_checkout_data, as it may be paid before its order exists.
+    """
+    # An intent that already paid for an order can't be used again
+    if Order.objects.filter(stripe_pid=stored['id']).exists():
+        return False
+    if not stored.get('confirming'):
+        return True
+    try:
+        intent = payments.retrieve_payment_intent(stored['id'])
+    except stripe.error.InvalidRequestError:
+        return False
+    if intent.status not in REUSABLE_INTENT_STATUSES:
+        return False
+    # The payment didn't go through, e.g. the card was declined
+    stored['confirming'] = False
+    return True
+
+
+def get_payment_intent(request, amount):
+    """
+    Return the client secret of a payment intent for this amount.
+    The intent is kept in the session and used again each time the
+    checkout page is loaded, only updating its amount when the bag's
+    total has changed. So reloading the page doesn't call Stripe, or
+    leave a trail of unused payment intents behind.
+    """
+    currency = settings.STRIPE_CURRENCY
+    stored = request.session.get(PAYMENT_INTENT_SESSION_KEY)
+    if stored and _stored_intent_usable(stored):
+        request.session.modified = True
+        if (stored['amount'], stored['currency']) == (amount, currency):
+            return stored['client_secret']
+        try:
+            payments.modify_payment_intent(stored['id'], amount=amount, currency=currency)
+        except stripe.error.InvalidRequestError:
+            # The intent can't be changed any more, e.g. it was cancelled
+            pass
+        else:
+            stored.update(amount=amount, currency=currency)
+            return stored['client_secret']
+
+    intent = payments.create_payment_intent(amount=amount, currency=currency)
+    request.session[PAYMENT_INTENT_SESSION_KEY] = {
+        'id': intent.id,
+        'client_secret': intent.client_secret,
+        'amount': amount,
+        'currency': currency,
+    }
+    return intent.client_secret
 
 
 @require_POST
 def cache_checkout_data(request):
     try:
         pid = request.POST.get('client_secret').split('_secret')[0]
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-        stripe.PaymentIntent.modify(pid, metadata={
-            'bag': json.dumps(request.session.get('bag', {})),
-            'save_info': request.POST.get('save_info'),
-            'username': request.user,
+        payments.modify_payment_intent(pid, metadata={
+            'bag': json.dumps(get_bag(request).as_dict()),
+            'save_info': request.POST.get('save_info') or '',
+            'username': str(request.user),
         })
+        # The payment is confirmed next, so from now on the intent may be paid
+        stored = request.session.get(PAYMENT_INTENT_SESSION_KEY)
+        if stored and stored['id'] == pid:
+            stored['confirming'] = True
+            request.session.modified = True
         return HttpResponse(status=200)
     except Exception as e:
         messages.error(request, 'Sorry, your payment cannot be \
@@ -34,10 +104,9 @@ def cache_checkout_data(request):
 
 def checkout(request):
     stripe_public_key = settings.STRIPE_PUBLIC_KEY
-    stripe_secret_key = settings.STRIPE_SECRET_KEY
 
     if request.method == 'POST':
-        bag = request.session.get('bag', {})
+        bag = get_bag(request).as_dict()
 
         form_data = {
             'full_name': request.POST['full_name'],
@@ -57,33 +126,17 @@ def checkout(request):
             pid = request.POST.get('client_secret').split('_secret')[0]
             order.stripe_pid = pid
             order.original_bag = json.dumps(bag)
-            order.save()
-            for item_id, item_data in bag.items():
-                try:
-                    product = Product.objects.get(id=item_id)
-                    if isinstance(item_data, int):
-                        order_line_item = OrderLineItem(
-                            order=order,
-                            product=product,
-                            quantity=item_data,
-                        )
-                        order_line_item.save()
-                    else:
-                        for size, quantity in item_data['items_by_size'].items():
-                            order_line_item = OrderLineItem(
-                                order=order,
-                                product=product,
-                                quantity=quantity,
-                                product_size=size,
-                            )
-                            order_line_item.save()
-                except Product.DoesNotExist:
-                    messages.error(request, (
-                        "One of the products in your bag wasn't found in our database. "
-                        "Please call us for assistance!")
-                    )
-                    order.delete()
-                    return redirect(reverse('view_bag'))
+            try:
+                build_order(order, bag)
+            except Product.DoesNotExist:
+                messages.error(request, (
+                    "One of the products in your bag wasn't found in our database. "
+                    "Please call us for assistance!")
+                )
+                return redirect(reverse('view_bag'))
+            except IntegrityError:
+                # The Stripe webhook has already created the order for this payment
+                order = Order.objects.get(stripe_pid=pid)
 
             # Save the info to the user's profile if all is well
             request.session['save_info'] = 'save-info' in request.POST
@@ -91,25 +144,22 @@ def checkout(request):
         else:
             messages.error(request, 'There was an error with your form. \
                 Please double check your information.')
+            client_secret = get_payment_intent(request, round(get_bag(request)['grand_total'] * 100))
     else:
-        bag = request.session.get('bag', {})
-        if not bag:
+        # Reuse the same bag the templates will render from this request
+        current_bag = get_bag(request)
+        if not current_bag['bag_items']:
             messages.error(request, "There's nothing in your bag at the moment")
             return redirect(reverse('products'))
 
-        current_bag = bag_contents(request)
         total = current_bag['grand_total']
         stripe_total = round(total * 100)
-        stripe.api_key = stripe_secret_key
-        intent = stripe.PaymentIntent.create(
-            amount=stripe_total,
-            currency=settings.STRIPE_CURRENCY,
-        )
+        client_secret = get_payment_intent(request, stripe_total)
 
         # Attempt to prefill the form with any info the user maintains in their profile
         if request.user.is_authenticated:
             try:
-                profile = UserProfile.objects.get(user=request.user)
+                profile = get_user_profile(request.user)
                 order_form = OrderForm(initial={
                     'full_name': profile.user.get_full_name(),
                     'email': profile.user.email,
@@ -134,7 +184,7 @@ def checkout(request):
     context = {
         'order_form': order_form,
         'stripe_public_key': stripe_public_key,
-        'client_secret': intent.client_secret,
+        'client_secret': client_secret,
     }
 
     return render(request, template, context)
@@ -148,7 +198,7 @@ def checkout_success(request, order_number):
     order = get_object_or_404(Order, order_number=order_number)
 
     if request.user.is_authenticated:
-        profile = UserProfile.objects.get(user=request.user)
+        profile = get_user_profile(request.user)
         # Attach the user's profile to the order
         order.user_profile = profile
         order.save()
@@ -172,8 +222,9 @@ def checkout_success(request, order_number):
         Your order number is {order_number}. A confirmation \
         email will be sent to {order.email}.')
 
-    if 'bag' in request.session:
-        del request.session['bag']
+    clear_cart(request)
+    # The next checkout needs a new payment intent
+    request.session.pop(PAYMENT_INTENT_SESSION_KEY, None)
 
     template = 'checkout/checkout_success.html'
     context = {
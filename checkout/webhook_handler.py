@@ -1,15 +1,15 @@
 from django.http import HttpResponse
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.conf import settings
+from django.db import IntegrityError
 
-from .models import Order, OrderLineItem
-from products.models import Product
+from . import payments
+from .mail_queue import queue_email
+from .models import Order, StripeEvent
+from .order_builder import build_order
 from profiles.models import UserProfile
 
 import json
-import time
-import stripe
 
 
 class StripeWH_Handler:
@@ -48,7 +48,9 @@ class StripeWH_Handler:
             {'order': order, 'contact_email': settings.DEFAULT_FROM_EMAIL}
         )
 
-        send_mail(
+        # Queued rather than sent here, so a slow mail server
+        # doesn't hold up the webhook. See send_queued_emails.
+        queue_email(
             subject,
             body,
             settings.DEFAULT_FROM_EMAIL,
@@ -73,13 +75,12 @@ class StripeWH_Handler:
         bag = intent.metadata.bag
         save_info = intent.metadata.save_info
 
-        # Get the Charge object
-        stripe_charge = stripe.Charge.retrieve(
-            intent.latest_charge
-        )
+        # Get the Charge object, unless Stripe already expanded it for us
+        stripe_charge = intent.latest_charge
+        if isinstance(stripe_charge, str):
+            stripe_charge = payments.retrieve_charge(stripe_charge)
         billing_details = stripe_charge.billing_details  # updated
         shipping_details = intent.shipping
-        grand_total = round(stripe_charge.amount / 100, 2)  # updated
 
         # Clean data in shipping details. if adress is empty.
         # I'll replace any empty strings in the shipping details with none.
@@ -92,9 +93,10 @@ class StripeWH_Handler:
         profile = None
         username = intent.metadata.username
         if username != 'AnonymousUser':
-            profile = UserProfile.objects.get(user__username=username)
+            # The order is still created if the user has since been deleted
+            profile = UserProfile.objects.filter(user__username=username).first()
             # Save profile info only if save profile box was checked in the from
-            if save_info:
+            if profile and save_info:
                 profile.default_phone_number = shipping_details.phone
                 profile.default_country = shipping_details.address.country
                 profile.default_postcode = shipping_details.address.postal_code
@@ -104,38 +106,14 @@ class StripeWH_Handler:
                 profile.default_county = shipping_details.address.state
                 profile.save()
 
-        order_exists = False
-        attempt = 1
-        while attempt <= 5:
-            try:
-                order = Order.objects.get(
-                    full_name__iexact=shipping_details.name,
-                    email__iexact=billing_details.email,
-                    phone_number__iexact=shipping_details.phone,
-                    country__iexact=shipping_details.address.country,
-                    postcode__iexact=shipping_details.address.postal_code,
-                    town_or_city__iexact=shipping_details.address.city,
-                    street_address1__iexact=shipping_details.address.line1,
-                    street_address2__iexact=shipping_details.address.line2,
-                    county__iexact=shipping_details.address.state,
-                    grand_total=grand_total,
-                    original_bag=bag,
-                    stripe_pid=pid,
-                )
-                order_exists = True
-                break
-            except Order.DoesNotExist:
-                attempt += 1
-                time.sleep(1)
-        if order_exists:
-            self._send_confirmation_email(order)
-            return HttpResponse(
-                content=f'Webhook received: {event["type"]} | SUCCESS: Verified order already in database',
-                status=200)
+        # Orders are unique per payment intent, so a single indexed lookup
+        # tells us whether the web checkout has already created this one.
+        order = Order.objects.filter(stripe_pid=pid).first()
+        if order:
+            result = 'Verified order already in database'
         else:
-            order = None
             try:
-                order = Order.objects.create(
+                order = Order(
                     full_name=shipping_details.name,
                     user_profile=profile,
                     email=billing_details.email,
@@ -149,33 +127,24 @@ class StripeWH_Handler:
                     original_bag=bag,
                     stripe_pid=pid,
                 )
-                for item_id, item_data in json.loads(bag).items():
-                    product = Product.objects.get(id=item_id)
-                    if isinstance(item_data, int):
-                        order_line_item = OrderLineItem(
-                            order=order,
-                            product=product,
-                            quantity=item_data,
-                        )
-                        order_line_item.save()
-                    else:
-                        for size, quantity in item_data['items_by_size'].items():
-                            order_line_item = OrderLineItem(
-                                order=order,
-                                product=product,
-                                quantity=quantity,
-                                product_size=size,
-                            )
-                            order_line_item.save()
+                # Nothing is left behind in the database if this fails
+                build_order(order, json.loads(bag))
+                result = 'Created order in webhook'
+            except IntegrityError:
+                # The web checkout was saving the same order at the same time.
+                # The unique stripe_pid makes the database wait for it to
+                # finish instead of us polling for it.
+                order = Order.objects.get(stripe_pid=pid)
+                result = 'Verified order already in database'
             except Exception as e:
-                if order:
-                    order.delete()
                 return HttpResponse(
                     content=f'Webhook received: {event["type"]} | ERROR: {e}',
                     status=500)
+
+        StripeEvent.objects.filter(event_id=event.id).update(order=order)
         self._send_confirmation_email(order)
         return HttpResponse(
-            content=f'Webhook received: {event["type"]} | SUCCESS: Created order in webhook',
+            content=f'Webhook received: {event["type"]} | SUCCESS: {result}',
             status=200)
 
     def handle_payment_intent_payment_failed(self, event):
@@ -1,3 +1,34 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from boutique_ado.performance import view_metrics
+
+
+@override_settings(PERFORMANCE_SAMPLE_RATE=1, PERFORMANCE_METRICS_TOKEN='secret')
+class PerformanceMiddlewareTests(TestCase):
+
+    def setUp(self):
+        view_metrics.reset()
+
+    def test_server_timing_for_staff_only(self):
+        response = self.client.get(reverse('products'))
+        self.assertNotIn('Server-Timing', response)
+
+        User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        self.client.login(username='staff', password='password')
+        response = self.client.get(reverse('products'))
+        timing = response['Server-Timing']
+        self.assertTrue(timing.startswith('total;dur='))
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="Database \(\d+ queries\)"')
+        self.assertIn('tpl;dur=', timing)
+        self.assertRegex(timing, r'cache;dur=[\d.]+;desc="Cache \(\d+ hits, \d+ misses\)"')
+
+    def test_metrics(self):
+        self.client.get(reverse('products'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_sampled_requests_total{view="products"} 1', response.content.decode())
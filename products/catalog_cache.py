@@ -0,0 +1,76 @@
+"""
+Caching for the product listing.
+
+Everything cached about the catalog includes the catalog version in its
+key. The version changes whenever a product or category is saved or
+deleted (see products/signals.py), so old entries are simply never read
+again and expire by themselves.
+
+The version is only seen by every process when the cache is shared
+(SHARED_CACHE in settings). A local memory cache has a version per
+process, so commands like import_products can't throw away what the web
+processes cached, and the cache timeouts are kept to a few seconds.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = 'products:catalog_version'
+
+# The query parameters that change what the product grid shows
+GRID_PARAMS = ('q', 'category', 'sort', 'direction', 'page', 'after', 'before')
+
+
+def _new_version():
+    # Based on the time rather than starting from 1, so a version
+    # that fell out of the cache is never handed out again
+    return int(time.time() * 1000)
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, _new_version(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """Throw away everything cached about the catalog"""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, _new_version(), None)
+
+
+def catalog_cache_key(prefix, *parts):
+    """A cache key for `parts` at the current catalog version"""
+    parts = (get_catalog_version(),) + parts
+    digest = hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+    return f'products:{prefix}:{digest}'
+
+
+def normalize_grid_params(params):
+    """
+    Reduce the query parameters to the ones that change the product grid,
+    so that equivalent listings share one cached grid.
+    """
+    normalized = {}
+    for param in GRID_PARAMS:
+        value = ' '.join(params.get(param, '').split())
+        if param == 'category':
+            value = ','.join(sorted(set(filter(None, value.split(',')))))
+        if value:
+            normalized[param] = value
+    return normalized
+
+
+def grid_cache_key(request):
+    """
+    The cache key for the product grid shown for this request.
+    Superusers see Edit and Delete links, so they get their own copy.
+    """
+    params = sorted(normalize_grid_params(request.GET).items())
+    return catalog_cache_key('grid', params, request.user.is_superuser)
@@ -0,0 +1,90 @@
+"""
+Reading product feeds one row at a time.
+
+Feeds can be CSV with a header row, JSON Lines with one product per
+line, or a JSON array of products. The JSON array can be a fixture
+like products/fixtures/products.json, where each product's values are
+under "fields". Whole files are never loaded into memory, so feeds
+of any size can be read.
+"""
+import csv
+import json
+import os
+from decimal import Decimal
+
+FEED_FORMATS = ('csv', 'json', 'jsonl')
+
+# How much of a JSON feed is read from the file at a time
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def feed_format(path):
+    """Guess the format of a feed from its file extension"""
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension == 'ndjson':
+        return 'jsonl'
+    if extension in FEED_FORMATS:
+        return extension
+    raise ValueError(f'Unknown feed format for {path}, choose one of {", ".join(FEED_FORMATS)}')
+
+
+def _product_values(item):
+    # Fixtures keep the product's values under "fields"
+    if 'fields' in item and 'model' in item:
+        return item['fields']
+    return item
+
+
+def read_csv(feed):
+    for row in csv.DictReader(feed):
+        yield row
+
+
+def read_jsonl(feed):
+    for line in feed:
+        line = line.strip()
+        if line:
+            yield _product_values(json.loads(line, parse_float=Decimal))
+
+
+def read_json(feed):
+    """
+    Read the objects of a JSON array one by one, decoding each object as
+    soon as all of it has been read rather than parsing the whole file.
+    """
+    # Prices are read as Decimal, as a float can't hold 53.99 exactly
+    decoder = json.JSONDecoder(parse_float=Decimal)
+    buffer = feed.read(JSON_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('A JSON feed must be an array of products')
+    buffer = buffer[1:]
+    end_of_file = False
+
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # Most likely the object carries on in the next chunk
+            if end_of_file:
+                raise
+            chunk = feed.read(JSON_CHUNK_SIZE)
+            end_of_file = not chunk
+            buffer += chunk
+            continue
+        yield _product_values(item)
+        buffer = buffer[end:]
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+    'jsonl': read_jsonl,
+}
+
+
+def read_feed(feed, format):
+    """Yield a dict of values for each product in an open feed file"""
+    return READERS[format](feed)
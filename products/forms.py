@@ -1,5 +1,6 @@
 from django import forms
 from .widgets import CustomClearableFileInput
+from .images import update_thumbnails
 from .models import Product, Category
 
 
@@ -22,3 +23,10 @@ class ProductForm(forms.ModelForm):
         self.fields['category'].choices = friendly_names
         for field_name, field in self.fields.items():
             field.widget.attrs['class'] = 'border-black rounded-0'
+
+    def save(self, commit=True):
+        """Make the thumbnails of a newly uploaded (or cleared) image"""
+        product = super().save(commit)
+        if commit and 'image' in self.changed_data:
+            update_thumbnails(product)
+        return product
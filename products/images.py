@@ -0,0 +1,116 @@
+"""
+Product images and their smaller copies for the product pages.
+
+Images fetched from elsewhere are stored by store_image, under a hash
+of their content, so an image used by many products is stored once.
+
+Every product image gets WebP and JPEG copies at each width in
+PRODUCT_IMAGE_WIDTHS (never wider than the original). They're saved
+next to the originals under thumbnails/, and the widths made are
+stored on the product so the templates can list them in a srcset
+without checking the storage.
+"""
+import hashlib
+import os
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from PIL import Image, ImageOps
+
+# File extension, Pillow format and save options of each kind of thumbnail
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+# File extensions of the image formats products can have
+IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+# Threads storing the same image share a lock, so it's only saved once
+_store_locks = [threading.Lock() for _ in range(64)]
+
+
+def thumbnail_name(image_name, width, extension):
+    stem = os.path.splitext(image_name)[0]
+    return f'thumbnails/{stem}-{width}w.{extension}'
+
+
+def make_thumbnails(image_name, storage=None):
+    """
+    Save the thumbnails of one image to the storage.
+    Returns the widths they were made at.
+    """
+    storage = storage or default_storage
+    with storage.open(image_name, 'rb') as image_file:
+        image = Image.open(image_file)
+        # Photos from phones are often stored sideways with a rotation flag
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    widths = sorted({min(width, image.width) for width in settings.PRODUCT_IMAGE_WIDTHS})
+    for width in widths:
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+        for extension, (image_format, options) in THUMBNAIL_FORMATS.items():
+            if image_format == 'JPEG' and resized.mode != 'RGB':
+                converted = resized.convert('RGB')
+            elif resized.mode not in ('RGB', 'RGBA'):
+                converted = resized.convert('RGBA')
+            else:
+                converted = resized
+            output = BytesIO()
+            converted.save(output, image_format, **options)
+
+            name = thumbnail_name(image_name, width, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(output.getvalue()))
+    return widths
+
+
+def store_image(content, storage=None):
+    """
+    Save an image to the storage, named by a hash of its content so the
+    same image is only stored once however many products use it.
+    Returns the name it was saved under.
+    Raises ValueError if the content isn't an image in a known format.
+    """
+    storage = storage or default_storage
+    try:
+        image_format = Image.open(BytesIO(content)).format
+    except Exception:
+        raise ValueError('Not an image')
+    if image_format not in IMAGE_EXTENSIONS:
+        raise ValueError(f'Unsupported image format {image_format}')
+
+    digest = hashlib.sha256(content).hexdigest()
+    name = f'{digest}.{IMAGE_EXTENSIONS[image_format]}'
+    with _store_locks[int(digest[:8], 16) % len(_store_locks)]:
+        if not storage.exists(name):
+            storage.save(name, ContentFile(content))
+    return name
+
+
+def update_thumbnails(product):
+    """Make the thumbnails of a product's image and store their widths"""
+    if product.image:
+        widths = make_thumbnails(product.image.name, product.image.storage)
+        product.thumbnail_widths = ','.join(str(width) for width in widths)
+    else:
+        product.thumbnail_widths = ''
+    product.save(update_fields=['thumbnail_widths'])
+
+
+def srcset(product, extension):
+    """The srcset attribute value for a product's thumbnails of one format"""
+    if not product.image or not product.thumbnail_widths:
+        return ''
+    storage = product.image.storage
+    return ', '.join(
+        f'{storage.url(thumbnail_name(product.image.name, width, extension))} {width}w'
+        for width in product.thumbnail_widths.split(',')
+    )
@@ -0,0 +1,87 @@
+import itertools
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from boutique_ado.benchmarking import percentile, rolled_back
+from products.models import Product
+from products.search import IContainsSearchBackend, get_search_backend
+
+# Common clothing words, plus generated ones so that, like in a real catalogue,
+# most words only appear in a small share of the products
+WORDS = (
+    'cotton denim linen wool silk leather jersey fleece velvet satin '
+    'jeans shirt dress skirt jacket coat sweater hoodie blazer shorts '
+    'slim relaxed bootcut flare skinny straight cropped pleated fitted '
+    'black white indigo navy olive grey blue red pink yellow striped '
+    'washable imported pocket zipper button collar sleeve waist hem '
+    'summer winter casual formal vintage classic everyday comfortable'
+).split() + [
+    ''.join(random.Random(i).choices('bcdfghjklmnprstvwz', k=3)) + suffix
+    for i, suffix in enumerate(['a', 'er', 'ion', 'y', 'o', 'ix', 'um', 'et'] * 250)
+]
+CUM_WEIGHTS = list(itertools.accumulate(1 / (rank + 20) for rank in range(len(WORDS))))
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare p50/p99 search latency of the full-text search backend with '
+        'the old icontains search on growing numbers of generated products. '
+        'Everything is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000],
+                            help='Catalogue sizes to measure')
+        parser.add_argument('--queries', type=int, default=50,
+                            help='Number of searches per size and backend')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        backends = [get_search_backend(), IContainsSearchBackend()]
+        rng = random.Random(42)
+        queries = [' '.join(self.words(rng, rng.randint(1, 2))) for _ in range(options['queries'])]
+
+        with rolled_back():
+            for size in sorted(options['sizes']):
+                self.fill(size, rng, options['batch_size'], backends[0])
+                for backend in backends:
+                    timings = []
+                    for query in queries:
+                        # Like the products page, count the results and fetch the first page
+                        start = time.perf_counter()
+                        results = backend.search(Product.objects.all(), query).order_by('-search_rank')
+                        results.count()
+                        list(results[:24])
+                        timings.append((time.perf_counter() - start) * 1000)
+                    timings.sort()
+                    self.stdout.write(
+                        f'{size:>9} products  {type(backend).__name__:<24} '
+                        f'p50 {statistics.median(timings):8.1f}ms  '
+                        f'p99 {percentile(timings, 99):8.1f}ms'
+                    )
+
+    def fill(self, size, rng, batch_size, backend):
+        """Generate products until there are `size` of them, and index them"""
+        missing = size - Product.objects.count()
+        while missing > 0:
+            batch = [
+                Product(
+                    name=' '.join(self.words(rng, 3)).title(),
+                    description=' '.join(self.words(rng, 30)),
+                    price=rng.randint(5, 200),
+                )
+                for _ in range(min(batch_size, missing))
+            ]
+            created = Product.objects.bulk_create(batch)
+            if created and created[0].pk is None:
+                # Not every database returns the new ids from bulk_create
+                created = Product.objects.order_by('-pk')[:len(batch)]
+            backend.index_products(created)
+            missing -= len(batch)
+
+    def words(self, rng, count):
+        # Roughly Zipf distributed, so a few words are common and most are rare
+        return rng.choices(WORDS, cum_weights=CUM_WEIGHTS, k=count)
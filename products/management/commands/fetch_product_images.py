@@ -0,0 +1,110 @@
+import html
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from products.catalog_cache import bump_catalog_version
+from products.images import store_image
+from products.models import Product
+
+# Images bigger than this are skipped rather than read into memory
+MAX_IMAGE_SIZE = 10 * 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Download the image_url of products that have no image, store each '
+        'image once however many products use it, and set the products\' image. '
+        'Products get their image as soon as it is stored, so an interrupted '
+        'run carries on where it stopped when run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Download the image_url of products that already have an image too')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Number of images downloaded at once')
+        parser.add_argument('--timeout', type=float, default=10,
+                            help='Seconds to wait for a server to connect or send data')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image_url=None).exclude(image_url='')
+        if not options['all']:
+            products = products.filter(Q(image='') | Q(image=None))
+
+        # Products sharing an image_url only download it once
+        product_ids = defaultdict(list)
+        for pk, image_url in products.values_list('pk', 'image_url').iterator():
+            product_ids[html.unescape(image_url)].append(pk)
+        if not product_ids:
+            self.stdout.write('No product images to download.')
+            return
+
+        self.timeout = options['timeout']
+        self.local = threading.local()
+        storage = Product._meta.get_field('image').storage
+        done = failed = downloaded_bytes = 0
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            urls = iter(product_ids)
+            running = set()
+            while True:
+                # Only a few downloads are queued at a time, however many images there are
+                for url in urls:
+                    running.add(executor.submit(self.fetch, url, storage))
+                    if len(running) >= options['workers'] * 2:
+                        break
+                if not running:
+                    break
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    url, name, size, error = future.result()
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'{url}: {error}')
+                        continue
+                    # Saved as soon as each image is stored, for a rerun to skip
+                    Product.objects.filter(pk__in=product_ids[url]).update(image=name, thumbnail_widths='')
+                    downloaded_bytes += size
+                    done += 1
+
+        bump_catalog_version()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Downloaded {done} images ({downloaded_bytes / 1024 / 1024:.1f}MB) in {elapsed:.1f}s '
+            f'({done / elapsed:.1f} images/s), {failed} failed. '
+            'Run generate_thumbnails to make their thumbnails.'
+        ))
+
+    def session(self):
+        """
+        Each thread has its own requests session, so connections to the
+        image server are kept open and reused between downloads
+        """
+        if not hasattr(self.local, 'session'):
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_maxsize=1, max_retries=2))
+            session.mount('https://', HTTPAdapter(pool_maxsize=1, max_retries=2))
+            self.local.session = session
+        return self.local.session
+
+    def fetch(self, url, storage):
+        """Runs in a worker thread, which only touches the network and the storage"""
+        try:
+            with self.session().get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                content = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    content += chunk
+                    if len(content) > MAX_IMAGE_SIZE:
+                        raise ValueError('Image too big')
+            return url, store_image(bytes(content), storage), len(content), None
+        except Exception as e:
+            return url, None, 0, repr(e)
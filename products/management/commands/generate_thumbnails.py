@@ -0,0 +1,67 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from products.catalog_cache import bump_catalog_version
+from products.images import make_thumbnails
+from products.models import Product
+
+
+def _make_thumbnails(image_name):
+    """Runs in a worker process, which only touches the storage, not the database"""
+    try:
+        return image_name, make_thumbnails(image_name), None
+    except Exception as e:
+        return image_name, None, repr(e)
+
+
+class Command(BaseCommand):
+    help = (
+        'Make the thumbnails of product images that have none yet, '
+        'resizing several images at once in a pool of processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Make the thumbnails of every product image again')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of processes resizing images')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image=None)
+        if not options['all']:
+            products = products.filter(thumbnail_widths='')
+        image_names = set(products.values_list('image', flat=True))
+        if not image_names:
+            self.stdout.write('No images need thumbnails.')
+            return
+
+        # The worker processes are forked from this one, and mustn't
+        # share its database connection
+        connections.close_all()
+
+        done = failed = 0
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [executor.submit(_make_thumbnails, name) for name in image_names]
+            for future in as_completed(futures):
+                image_name, widths, error = future.result()
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{image_name}: {error}')
+                    continue
+                # update() rather than save(), so the search index isn't updated for each product
+                Product.objects.filter(image=image_name).update(
+                    thumbnail_widths=','.join(str(width) for width in widths))
+                done += 1
+
+        # The cached product grids still have the old image markup
+        bump_catalog_version()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Made thumbnails of {done} images in {elapsed:.1f}s '
+            f'({done / elapsed:.1f} images/s), {failed} failed.'
+        ))
@@ -0,0 +1,171 @@
+import time
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries, transaction
+from django.utils import timezone
+
+from products.catalog_cache import bump_catalog_version
+from products.feeds import FEED_FORMATS, feed_format, read_feed
+from products.models import Category, Product
+from products.search import get_search_backend
+
+# The product fields a feed can set
+IMPORT_FIELDS = ('name', 'description', 'has_sizes', 'price', 'rating', 'image_url', 'image')
+
+
+class Command(BaseCommand):
+    help = (
+        'Add or update products from a CSV, JSON or JSON Lines feed, matching '
+        'existing products by sku. The feed is read and saved in batches, '
+        'so feeds of any size are imported in the same amount of memory.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The feed file')
+        parser.add_argument('--format', choices=FEED_FORMATS,
+                            help='Format of the feed, guessed from its extension by default')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            format = options['format'] or feed_format(path)
+        except ValueError as e:
+            raise CommandError(e)
+
+        # Categories by id and by name, looked up once each for the whole import
+        self.categories = {}
+        for category in Category.objects.all():
+            self.categories[str(category.pk)] = category
+            self.categories[category.name] = category
+        self.search_backend = get_search_backend()
+        self.created = self.updated = self.unchanged = self.skipped = 0
+
+        start = time.perf_counter()
+        with open(path, newline='', encoding='utf-8') as feed:
+            rows = enumerate(read_feed(feed, format), start=1)
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                self.import_batch(batch)
+                # With DEBUG on, the SQL of every query is kept, and with
+                # thousands of rows in each query that soon adds up
+                reset_queries()
+                if self.stdout.isatty():
+                    self.stdout.write(f'{batch[-1][0]} rows read', ending='\r')
+                    self.stdout.flush()
+
+        # One change to the catalog for the whole import, rather than one per product
+        bump_catalog_version()
+        elapsed = time.perf_counter() - start
+        rows_read = self.created + self.updated + self.unchanged + self.skipped
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {rows_read} rows in {elapsed:.1f}s ({rows_read / elapsed:.0f} rows/s): '
+            f'{self.created} created, {self.updated} updated, {self.unchanged} unchanged, {self.skipped} skipped.'
+        ))
+
+    def import_batch(self, batch):
+        # Later rows for the same sku replace earlier ones
+        values_by_sku = {}
+        for line_number, row in batch:
+            values = self.clean(line_number, row)
+            if values is None:
+                self.skipped += 1
+            else:
+                values_by_sku[values.pop('sku')] = values
+
+        with transaction.atomic():
+            existing = {
+                product.sku: product
+                for product in Product.objects.filter(sku__in=values_by_sku).only(
+                    'id', 'sku', 'category', 'price_updated', 'thumbnail_widths', *IMPORT_FIELDS)
+            }
+            new_products = []
+            changed_products = []
+            updated_fields = set()
+            now = timezone.now()
+            for sku, values in values_by_sku.items():
+                product = existing.get(sku)
+                if product is None:
+                    new_products.append(Product(sku=sku, **values))
+                    continue
+                changes = {
+                    field: value for field, value in values.items()
+                    if value != (product.image.name if field == 'image' else getattr(product, field))
+                }
+                if not changes:
+                    self.unchanged += 1
+                    continue
+                if 'price' in changes:
+                    # bulk_update skips Product.save, so bags are told here
+                    product.price_updated = now
+                    updated_fields.add('price_updated')
+                if 'image' in changes:
+                    product.thumbnail_widths = ''
+                    updated_fields.add('thumbnail_widths')
+                for field, value in changes.items():
+                    setattr(product, field, value)
+                updated_fields.update(changes)
+                changed_products.append(product)
+
+            Product.objects.bulk_create(new_products)
+            if changed_products:
+                Product.objects.bulk_update(changed_products, updated_fields)
+
+            # bulk_create doesn't set the ids on every database, so the
+            # products are read back for the search index
+            indexed_skus = [product.sku for product in new_products + changed_products]
+            if indexed_skus:
+                self.search_backend.index_products(
+                    Product.objects.filter(sku__in=indexed_skus).only('id', 'name', 'description'))
+
+        self.created += len(new_products)
+        self.updated += len(changed_products)
+
+    def clean(self, line_number, row):
+        """
+        Turn a row of the feed into values for a product,
+        or return None if the row can't be imported
+        """
+        sku = str(row.get('sku') or '').strip()
+        if not sku:
+            self.stderr.write(f'Row {line_number}: no sku')
+            return None
+
+        values = {'sku': sku}
+        try:
+            for field in IMPORT_FIELDS:
+                if field in row:
+                    model_field = Product._meta.get_field(field)
+                    value = row[field]
+                    if value == '' and model_field.null:
+                        value = None
+                    elif field == 'has_sizes' and isinstance(value, str):
+                        value = value.strip().lower() in ('true', 'yes', 'y', 't', '1')
+                    values[field] = model_field.clean(value, None)
+            if 'category' in row:
+                category = self.category(row['category'])
+                values['category_id'] = category.pk if category else None
+        except ValidationError as e:
+            self.stderr.write(f'Row {line_number} ({sku}): {"; ".join(e.messages)}')
+            return None
+        return values
+
+    def category(self, value):
+        """
+        Find a category by its id or its name,
+        adding categories that don't exist yet by name
+        """
+        value = str(value or '').strip()
+        if not value:
+            return None
+        if value not in self.categories:
+            if value.isdigit():
+                raise ValidationError(f'No category with id {value}')
+            category = Category.objects.create(
+                name=value, friendly_name=value.replace('_', ' ').title())
+            self.categories[value] = self.categories[str(category.pk)] = category
+        return self.categories[value]
@@ -0,0 +1,58 @@
+from django.db import migrations
+
+# The SQL is written out here rather than taken from products/search.py,
+# so later changes to the search backends don't change this migration.
+# Only Postgres and SQLite have a search index, other databases use icontains.
+
+POSTGRES_INSTALL = [
+    'CREATE TABLE IF NOT EXISTS products_product_search ('
+    'product_id bigint PRIMARY KEY REFERENCES {products} (id) '
+    'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+    'document tsvector NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS products_product_search_document_idx '
+    'ON products_product_search USING GIN (document)',
+    'INSERT INTO products_product_search (product_id, document) '
+    "SELECT id, setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B') "
+    'FROM {products}',
+]
+
+SQLITE_INSTALL = [
+    'CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts '
+    "USING fts5(name, description, tokenize='porter unicode61')",
+    'INSERT INTO products_product_fts (rowid, name, description) '
+    "SELECT id, coalesce(name, ''), coalesce(description, '') FROM {products}",
+]
+
+INSTALL = {
+    'postgresql': POSTGRES_INSTALL,
+    'sqlite': SQLITE_INSTALL,
+}
+
+UNINSTALL = {
+    'postgresql': ['DROP TABLE IF EXISTS products_product_search'],
+    'sqlite': ['DROP TABLE IF EXISTS products_product_fts'],
+}
+
+
+def install_search_index(apps, schema_editor):
+    # Index the products that are already in the database too
+    products = schema_editor.quote_name(apps.get_model('products', 'Product')._meta.db_table)
+    for sql in INSTALL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql.format(products=products))
+
+
+def uninstall_search_index(apps, schema_editor):
+    for sql in UNINSTALL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_auto_20241007_1955'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
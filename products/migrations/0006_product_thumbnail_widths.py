@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_price_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='thumbnail_widths',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
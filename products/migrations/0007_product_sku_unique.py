@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:16
+
+import logging
+
+from django.db import migrations, models
+from django.db.models import Count
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_duplicate_skus(apps, schema_editor):
+    """
+    Keep the sku of the first product with each sku and give the others
+    a sku ending in -duplicate-<pk>, so the unique constraint can be added
+    without deleting anything. Empty skus become NULL, which can repeat.
+    """
+    Product = apps.get_model('products', 'Product')
+    Product.objects.filter(sku='').update(sku=None)
+    duplicated = (Product.objects.exclude(sku=None).values('sku')
+                  .annotate(products=Count('pk')).filter(products__gt=1).values_list('sku', flat=True))
+    for sku in duplicated:
+        kept, *duplicates = Product.objects.filter(sku=sku).order_by('pk').values_list('pk', flat=True)
+        for pk in duplicates:
+            Product.objects.filter(pk=pk).update(sku=f'{sku}-duplicate-{pk}')
+            logger.warning('Product %s had the same sku as product %s: %s', pk, kept, sku)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_thumbnail_widths'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_duplicate_skus, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=254, null=True, unique=True),
+        ),
+    ]
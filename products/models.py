@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 
 
 class Category(models.Model):
@@ -6,7 +8,7 @@ class Category(models.Model):
     class Meta:
         verbose_name_plural = 'Categories'
 
-    name = models.CharField(max_length=254)
+    name = models.CharField(max_length=254, db_index=True)
     friendly_name = models.CharField(max_length=254, null=True, blank=True)
 
     def __str__(self):
@@ -17,8 +19,15 @@ class Category(models.Model):
 
 
 class Product(models.Model):
+
+    class Meta:
+        indexes = [
+            # Sorting the products page by name sorts on lower(name)
+            models.Index(Lower('name'), name='product_lower_name_idx'),
+        ]
+
     category = models.ForeignKey('Category', null=True, blank=True, on_delete=models.SET_NULL)
-    sku = models.CharField(max_length=254, null=True, blank=True)
+    sku = models.CharField(max_length=254, null=True, blank=True, unique=True)
     name = models.CharField(max_length=254)
     description = models.TextField()
     has_sizes = models.BooleanField(default=False, blank=True, null=True)
@@ -26,6 +35,32 @@ class Product(models.Model):
     rating = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
     image_url = models.URLField(max_length=1024, null=True, blank=True)
     image = models.ImageField(null=True, blank=True)
+    # Widths of the image's thumbnails, comma separated, see products/images.py
+    thumbnail_widths = models.CharField(max_length=100, blank=True, default='', editable=False)
+    # When the price last changed, so bags know to update their totals
+    price_updated = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # Remember the price as loaded, to spot a change of price on save.
+        # Read from __dict__ so a deferred price isn't fetched for it.
+        product._loaded_price = product.__dict__.get('price')
+        return product
+
+    def save(self, *args, **kwargs):
+        """
+        Override the original save method to record when the price changes
+        """
+        price_loaded = 'price' not in self.get_deferred_fields()
+        if price_loaded and self.price != getattr(self, '_loaded_price', None):
+            self.price_updated = timezone.now()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'price_updated'}
+        super().save(*args, **kwargs)
+        if price_loaded:
+            self._loaded_price = self.price
 
     def __str__(self):
         return self.name
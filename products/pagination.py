@@ -0,0 +1,181 @@
+"""
+Pagination for the product listing.
+
+The first few pages are numbered and fetched with an offset as usual.
+Past PRODUCTS_OFFSET_PAGES, listings sorted by name, price or rating
+(or not sorted at all) switch to keyset pagination. The next page is
+then found by seeking past the last product shown, using a cursor in
+the url, instead of counting through every product before it.
+"""
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import F, Q
+
+from .catalog_cache import catalog_cache_key
+
+# Fields the listing can be sorted on that support keyset pagination,
+# and how to turn a cursor value back into a value for that field
+KEYSET_FIELDS = {
+    'pk': int,
+    'lower_name': str,
+    'price': Decimal,
+    'rating': Decimal,
+}
+
+CURSOR_SALT = 'products.pagination.cursor'
+
+
+def cached_count(queryset):
+    """
+    Count the queryset, caching the result for PRODUCTS_COUNT_CACHE_TIMEOUT
+    seconds or until the catalog changes. The cache key is based on the count
+    query itself, so every combination of filters is cached separately.
+    """
+    timeout = settings.PRODUCTS_COUNT_CACHE_TIMEOUT
+    # An empty queryset, like a search with no matches, has no SQL to key on
+    if queryset.query.is_empty():
+        return 0
+    if not timeout:
+        return queryset.count()
+    key = catalog_cache_key('count', queryset.order_by().query.sql_with_params())
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def _parse_ordering(ordering):
+    if not ordering:
+        return 'pk', False
+    descending = ordering.startswith('-')
+    return ordering.lstrip('-'), descending
+
+
+def _order(queryset, field, descending):
+    """
+    Order by the field with the primary key as a tie breaker,
+    so every product has a fixed place in the listing.
+    Empty values always count as the lowest, whatever the database.
+    """
+    if field == 'pk':
+        return queryset.order_by('-pk' if descending else 'pk')
+    if descending:
+        return queryset.order_by(F(field).desc(nulls_last=True), '-pk')
+    return queryset.order_by(F(field).asc(nulls_first=True), 'pk')
+
+
+def _seek(queryset, field, value, pk, descending):
+    """Filter the queryset down to the products after (value, pk)"""
+    if field == 'pk':
+        return queryset.filter(pk__lt=pk) if descending else queryset.filter(pk__gt=pk)
+
+    if value is None:
+        if descending:
+            return queryset.filter(**{f'{field}__isnull': True, 'pk__lt': pk})
+        return queryset.filter(Q(**{f'{field}__isnull': False}) | Q(**{f'{field}__isnull': True, 'pk__gt': pk}))
+
+    if descending:
+        return queryset.filter(
+            Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}) | Q(**{f'{field}__isnull': True}))
+    return queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk}))
+
+
+def _make_cursor(product, field):
+    value = product.pk if field == 'pk' else getattr(product, field)
+    return signing.dumps([None if value is None else str(value), product.pk], salt=CURSOR_SALT, compress=True)
+
+
+def _read_cursor(cursor, field):
+    try:
+        value, pk = signing.loads(cursor, salt=CURSOR_SALT)
+        if value is not None:
+            value = KEYSET_FIELDS[field](value)
+        return value, int(pk)
+    except (signing.BadSignature, ValueError, TypeError, ArithmeticError):
+        return None
+
+
+def paginate_products(params, products, ordering=None):
+    """
+    Return one page of products and the details the template needs
+    to link to the pages around it, keeping the other query parameters.
+    `params` is a dictionary of the listing's query parameters and
+    `ordering` is the field the products are sorted on, as passed to order_by.
+    """
+    page_size = settings.PRODUCTS_PER_PAGE
+    field, descending = _parse_ordering(ordering)
+    keyset = field in KEYSET_FIELDS
+
+    query = {param: value for param, value in params.items() if param not in ('page', 'after', 'before')}
+
+    def link(**page_params):
+        return f'?{urlencode({**query, **page_params})}'
+
+    total = cached_count(products)
+    page = {
+        'total': total,
+        'pages': max((total + page_size - 1) // page_size, 1),
+        'number': None,
+        'previous_url': None,
+        'next_url': None,
+    }
+
+    after = params.get('after')
+    before = params.get('before')
+    cursor = keyset and _read_cursor(after or before or '', field)
+
+    if cursor:
+        # Seek from the cursor. Paging backwards seeks in the
+        # opposite direction, then puts the page back in order.
+        value, pk = cursor
+        backwards = bool(before) and not after
+        seek_descending = descending != backwards
+        ordered = _order(products, field, seek_descending)
+        object_list = list(_seek(ordered, field, value, pk, seek_descending)[:page_size + 1])
+        has_more = len(object_list) > page_size
+        object_list = object_list[:page_size]
+        if backwards:
+            object_list.reverse()
+
+        if object_list:
+            if has_more or not backwards:
+                page['previous_url'] = link(before=_make_cursor(object_list[0], field))
+            if has_more or backwards:
+                page['next_url'] = link(after=_make_cursor(object_list[-1], field))
+        if backwards and not has_more:
+            # Back at the start, so show the numbered first page instead
+            page['previous_url'] = None
+            page['number'] = 1
+            object_list = list(_order(products, field, descending)[:page_size])
+            if total > page_size:
+                page['next_url'] = link(page=2)
+        page['object_list'] = object_list
+        return page
+
+    try:
+        number = max(int(params.get('page', 1)), 1)
+    except ValueError:
+        number = 1
+    if keyset:
+        number = min(number, settings.PRODUCTS_OFFSET_PAGES)
+
+    offset = (number - 1) * page_size
+    object_list = list(_order(products, field, descending)[offset:offset + page_size + 1])
+    has_more = len(object_list) > page_size
+    object_list = object_list[:page_size]
+
+    page['number'] = number
+    page['object_list'] = object_list
+    if number > 1:
+        page['previous_url'] = link(page=number - 1)
+    if has_more:
+        if keyset and number >= settings.PRODUCTS_OFFSET_PAGES:
+            page['next_url'] = link(after=_make_cursor(object_list[-1], field))
+        else:
+            page['next_url'] = link(page=number + 1)
+    return page
@@ -0,0 +1,156 @@
+"""
+Full-text product search.
+
+Each backend keeps its own index of product names and descriptions
+next to the products table, created by migration 0003 and kept up to
+date by the signals in products/signals.py. Searching filters a Product queryset down to
+the matches and annotates each one with a `search_rank`, where a
+higher rank is a better match.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+
+class IContainsSearchBackend:
+    """
+    The original search, a case insensitive match on name or description.
+    Used on databases with no full-text support.
+    """
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, queryset, query):
+        # "i" in __icontains stands for "Case insensitive", '|' stands for "or"
+        queries = Q(name__icontains=query) | Q(description__icontains=query)
+        return queryset.filter(queries).annotate(
+            search_rank=RawSQL('0', (), output_field=FloatField()))
+
+
+class PostgresSearchBackend(IContainsSearchBackend):
+    """
+    Postgres full-text search on a GIN indexed tsvector of each product,
+    stemmed with the english configuration and ranked with ts_rank.
+    Names are weighted above descriptions.
+    """
+    table = 'products_product_search'
+
+    def index_products(self, products):
+        rows = [(product.pk, product.name or '', product.description or '') for product in products]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (product_id, document) VALUES '
+                "(%s, setweight(to_tsvector('english', %s), 'A') || "
+                "setweight(to_tsvector('english', %s), 'B')) "
+                'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                rows,
+            )
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE product_id = ANY(%s)', [list(product_ids)])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+            cursor.execute(
+                f'INSERT INTO {self.table} (product_id, document) '
+                "SELECT id, setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+                "setweight(to_tsvector('english', coalesce(description, '')), 'B') "
+                'FROM products_product'
+            )
+
+    def search(self, queryset, query):
+        tsquery = "websearch_to_tsquery('english', %s)"
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT product_id FROM {self.table} WHERE document @@ {tsquery}', (query,)
+        )).annotate(search_rank=RawSQL(
+            f'SELECT ts_rank(document, {tsquery}) FROM {self.table} '
+            'WHERE product_id = products_product.id', (query,),
+            output_field=FloatField(),
+        ))
+
+
+class SQLiteSearchBackend(IContainsSearchBackend):
+    """
+    SQLite FTS5 search for local development, stemmed with the porter
+    tokenizer and ranked with bm25. Names are weighted above descriptions.
+    Only the best PRODUCT_SEARCH_MAX_RESULTS matches are returned.
+    """
+    table = 'products_product_fts'
+
+    def index_products(self, products):
+        rows = [(product.pk, product.name or '', product.description or '') for product in products]
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [row[:1] for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)', rows)
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, name, description) '
+                "SELECT id, coalesce(name, ''), coalesce(description, '') FROM products_product"
+            )
+
+    def search(self, queryset, query):
+        # Quote every word, so characters that mean something to FTS5
+        # in the user's search can't cause a syntax error
+        words = re.findall(r'\w+', query)
+        if not words:
+            return super().search(queryset.none(), query)
+        match = ' '.join(f'"{word}"' for word in words)
+
+        # bm25 can only be worked out as part of a MATCH query, so the best
+        # matches are ranked here first and the queryset is limited to them.
+        # bm25 is lower for better matches, so flip it round.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, -bm25({self.table}, 10.0, 1.0) AS search_rank '
+                f'FROM {self.table} WHERE {self.table} MATCH %s '
+                'ORDER BY search_rank DESC LIMIT %s',
+                (match, settings.PRODUCT_SEARCH_MAX_RESULTS),
+            )
+            ranks = cursor.fetchall()
+        if not ranks:
+            return super().search(queryset.none(), query)
+
+        case = ' '.join('WHEN %s THEN %s' for _ in ranks)
+        return queryset.filter(pk__in=[pk for pk, rank in ranks]).annotate(search_rank=RawSQL(
+            f'CASE products_product.id {case} END',
+            [value for pk_and_rank in ranks for value in pk_and_rank],
+            output_field=FloatField(),
+        ))
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_search_backend():
+    """
+    Return the search backend set in PRODUCT_SEARCH_BACKEND,
+    or the best one for the database in use.
+    """
+    backend_path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    return BACKENDS.get(connection.vendor, IContainsSearchBackend)()
@@ -0,0 +1,20 @@
+from django import template
+
+from products.images import srcset
+
+register = template.Library()
+
+
+@register.inclusion_tag('products/includes/product_image.html')
+def product_image(product, css_class='', sizes='100vw'):
+    """
+    A product's image, letting the browser pick the best sized thumbnail.
+    `sizes` is how wide the image is shown, as in the img sizes attribute.
+    """
+    return {
+        'product': product,
+        'css_class': css_class,
+        'sizes': sizes,
+        'webp_srcset': srcset(product, 'webp'),
+        'jpeg_srcset': srcset(product, 'jpg'),
+    }
@@ -1,3 +1,254 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from boutique_ado.testing import QueryBudgetMixin
+
+from . import feeds
+from .images import make_thumbnails
+from .management.commands import import_products
+from .models import Category, Product
+from .search import IContainsSearchBackend, PostgresSearchBackend, SQLiteSearchBackend, get_search_backend
+
+
+class ProductPageQueryTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = [
+            Category.objects.create(name=f'category_{number}', friendly_name=f'Category {number}')
+            for number in range(3)
+        ]
+        for number in range(30):
+            Product.objects.create(
+                category=categories[number % 3],
+                sku=f'sku{number}',
+                name=f'Product {number}',
+                description='A product',
+                price=10 + number,
+                rating=4,
+            )
+        cls.product = Product.objects.first()
+
+    def setUp(self):
+        # Product counts are cached, don't let one test hide another's count query
+        cache.clear()
+
+    def test_listing_query_budget(self):
+        with self.assertMaxQueries(2):
+            response = self.client.get(reverse('products'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Category 1')
+
+    def test_sorted_category_listing_query_budget(self):
+        with self.assertMaxQueries(3):
+            response = self.client.get(
+                reverse('products'), {'category': 'category_1,category_2', 'sort': 'name', 'direction': 'desc'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_query_budget(self):
+        with self.assertMaxQueries(1):
+            response = self.client.get(reverse('product_detail', args=[self.product.id]))
+        self.assertContains(response, self.product.category.friendly_name)
+
+    def test_cached_grid_query_budget(self):
+        self.client.get(reverse('products'), {'category': 'category_1', 'sort': 'price', 'direction': 'asc'})
+        # Same listing with the parameters in a different order
+        with self.assertMaxQueries(0):
+            response = self.client.get(reverse('products'), {'direction': 'asc', 'category': 'category_1', 'sort': 'price'})
+        self.assertContains(response, 'Product 1')
+
+    def test_product_change_invalidates_grid(self):
+        self.client.get(reverse('products'))
+        self.product.name = 'Renamed Product'
+        self.product.save()
+        response = self.client.get(reverse('products'))
+        self.assertContains(response, 'Renamed Product')
+
+    def test_search_without_matches(self):
+        for query in ('zzzqqq', '!!!'):
+            response = self.client.get(reverse('products'), {'q': query})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotContains(response, 'Product 1')
+
+
+class SearchTests(TestCase):
+    """Runs against the search backend of the database the tests use"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Product.objects.create(
+            sku='shoes', name='Running Shoes', description='Light shoes for the road', price=50)
+        cls.shorts = Product.objects.create(
+            sku='shorts', name='Shorts', description='Good for running in the heat', price=20)
+        cls.shirt = Product.objects.create(sku='shirt', name='Shirt', description='Cotton', price=15)
+
+    def search(self, query):
+        results = get_search_backend().search(Product.objects.all(), query)
+        return list(results.order_by('-search_rank', 'pk'))
+
+    def test_stemmed_and_ranked(self):
+        # "runs" matches "Running" and "running", and a match on the name ranks first
+        self.assertEqual(self.search('runs'), [self.shoes, self.shorts])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.shirt.name = 'Running Shirt'
+        self.shirt.save()
+        self.assertIn(self.shirt, self.search('running'))
+
+        self.shoes.delete()
+        self.assertNotIn('Running Shoes', [product.name for product in self.search('running')])
+
+    def test_search_syntax_is_plain_text(self):
+        self.assertEqual(self.search('road" (*'), [self.shoes])
+
+    @override_settings(PRODUCT_SEARCH_BACKEND='products.search.IContainsSearchBackend')
+    def test_icontains_backend(self):
+        self.assertIsInstance(get_search_backend(), IContainsSearchBackend)
+        self.assertEqual(self.search('cotton'), [self.shirt])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_sqlite_backend_picked(self):
+        self.assertIsInstance(get_search_backend(), SQLiteSearchBackend)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Postgres only')
+    def test_postgres_backend_picked(self):
+        self.assertIsInstance(get_search_backend(), PostgresSearchBackend)
+        # websearch_to_tsquery syntax, "-" excludes a word
+        self.assertEqual(self.search('running -heat'), [self.shoes])
+
+
+class ThumbnailTests(TestCase):
+
+    def test_thumbnails_never_wider_than_image(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                MEDIA_ROOT=media_root, PRODUCT_IMAGE_WIDTHS=[100, 300]):
+            image = BytesIO()
+            Image.new('RGB', (200, 100)).save(image, 'JPEG')
+            default_storage.save('photo.jpg', ContentFile(image.getvalue()))
+
+            self.assertEqual(make_thumbnails('photo.jpg'), [100, 200])
+            with default_storage.open('thumbnails/photo-100w.webp') as thumbnail:
+                self.assertEqual(Image.open(thumbnail).size, (100, 50))
+
+
+class ImportProductsTests(QueryBudgetMixin, TestCase):
+
+    def import_feed(self, name, content, batch_size=2):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, name)
+            with open(path, 'w') as feed:
+                feed.write(content)
+            call_command('import_products', path, batch_size=batch_size, stdout=StringIO(), stderr=StringIO())
+
+    def test_csv_upserts_by_sku(self):
+        jeans = Category.objects.create(name='jeans')
+        Product.objects.create(sku='a1', name='Old name', description='Jeans', price=10, category=jeans)
+        self.import_feed('feed.csv', (
+            'sku,name,description,price,has_sizes,category\n'
+            'a1,New name,Jeans,12.50,true,jeans\n'
+            'b2,Shirt,A shirt,20,false,shirts\n'
+            ',No sku,Skipped,1,,\n'
+            'c3,Bad price,Skipped,abc,,\n'
+        ))
+        updated = Product.objects.get(sku='a1')
+        self.assertEqual((updated.name, updated.price, updated.has_sizes), ('New name', Decimal('12.50'), True))
+        self.assertIsNotNone(updated.price_updated)
+        self.assertEqual(Product.objects.get(sku='b2').category.name, 'shirts')
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_json_fixture_read_in_chunks(self):
+        category = Category.objects.create(name='jeans')
+        fixture = (
+            '[{"pk": 1, "model": "products.product", "fields": {"sku": "a1", "name": "Jeans", '
+            '"description": "Blue", "price": 53.99, "rating": 4.6, "category": %d}},'
+            ' {"sku": "b2", "name": "Shirt", "description": "White", "price": 20}]' % category.pk
+        )
+        with mock.patch.object(feeds, 'JSON_CHUNK_SIZE', 16):
+            self.import_feed('feed.json', fixture)
+        self.assertEqual(Product.objects.get(sku='a1').price, Decimal('53.99'))
+        self.assertEqual(Product.objects.get(sku='a1').category, category)
+        self.assertTrue(Product.objects.filter(sku='b2').exists())
+
+    def test_batch_query_budget(self):
+        for number in range(50):
+            Product.objects.create(sku=f'sku{number}', name=f'Product {number}', description='A product', price=10)
+        # One price change, and a new name for everything else
+        rows = ['sku0,Product 0,A product,11'] + [
+            f'sku{number},Renamed {number},A product,10' for number in range(1, 50)]
+        # The categories, then for the batch: the existing products, the
+        # update and reading the products back and indexing them
+        # The command clears the query log after each batch, which would hide the queries
+        with self.assertMaxQueries(6), mock.patch.object(import_products, 'reset_queries'):
+            self.import_feed('feed.csv', 'sku,name,description,price\n' + '\n'.join(rows), batch_size=50)
+        self.assertEqual(Product.objects.get(sku='sku0').price, Decimal('11'))
+        self.assertEqual(Product.objects.filter(name__startswith='Renamed').count(), 49)
+
+
+class StubImageHandler(BaseHTTPRequestHandler):
+    """Serves the same small JPEG at every path except /missing.jpg"""
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path == '/missing.jpg':
+            self.send_error(404)
+            return
+        image = BytesIO()
+        Image.new('RGB', (20, 20), 'red').save(image, 'JPEG')
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(image.getvalue())))
+        self.end_headers()
+        self.wfile.write(image.getvalue())
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchProductImagesTests(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubImageHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        StubImageHandler.requests = []
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server.server_port}{path}'
+
+    def test_images_stored_once_and_rerun_skips_them(self):
+        for sku, path in [('a', '/one.tif?hei=380&amp;wid=380'), ('b', '/two.jpg'), ('c', '/missing.jpg')]:
+            Product.objects.create(sku=sku, name=sku, description=sku, price=1, image_url=self.url(path))
+        call_command('fetch_product_images', stdout=StringIO(), stderr=StringIO())
+
+        one, two, missing = Product.objects.order_by('sku')
+        self.assertTrue(one.image.name.endswith('.jpg'))
+        # Both URLs serve the same image, so it is stored once
+        self.assertEqual(one.image.name, two.image.name)
+        self.assertTrue(default_storage.exists(one.image.name))
+        self.assertIn('/one.tif?hei=380&wid=380', StubImageHandler.requests)
+        self.assertFalse(missing.image)
+
+        StubImageHandler.requests = []
+        call_command('fetch_product_images', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(StubImageHandler.requests, ['/missing.jpg'])
@@ -1,34 +1,76 @@
 from django.shortcuts import render, redirect, reverse, get_object_or_404
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.core.cache import cache
 from django.db.models.functions import Lower
+from django.template.loader import render_to_string
 
 from .models import Product, Category
 from .forms import ProductForm
+from .catalog_cache import grid_cache_key, normalize_grid_params
+from .pagination import paginate_products
+from .search import get_search_backend
+
+
+# The only product columns the product cards in products.html use
+LISTING_FIELDS = (
+    'id', 'name', 'price', 'rating', 'image', 'thumbnail_widths',
+    'category', 'category__name', 'category__friendly_name',
+)
 
 
 def all_products(request):
     """ A view to show all products, including sorting and search queries """
 
-    products = Product.objects.all()
+    # If the search query is empty
+    if 'q' in request.GET and not request.GET['q'].strip():
+        messages.error(request, "You didn't enter any search criteria!")
+        return redirect(reverse('products'))
+
+    # The product grid only depends on the listing's query parameters, so it's
+    # rendered once and cached until the catalog changes, see products/catalog_cache.py
+    key = grid_cache_key(request)
+    product_grid = cache.get(key)
+    if product_grid is None:
+        context = product_listing(normalize_grid_params(request.GET))
+        product_grid = render_to_string('products/includes/product_grid.html', context, request)
+        if settings.PRODUCTS_GRID_CACHE_TIMEOUT:
+            cache.set(key, product_grid, settings.PRODUCTS_GRID_CACHE_TIMEOUT)
+
+    context = {
+        'product_grid': product_grid,
+    }
+
+    return render(request, 'products/products.html', context)
+
+
+def product_listing(params):
+    """
+    The products, search term, categories and sorting to show for
+    the given (normalized) query parameters
+    """
+
+    # Each card shows its category, so fetch the categories in the same query
+    products = Product.objects.select_related('category').only(*LISTING_FIELDS)
     # we set it to none, just to avoid errors when loading page without a search term
     query = None
     # same with category & sort & direction
     categories = None
     sort = None
     direction = None
+    ordering = None
 
     # The search phrase appears as GET
-    if request.GET:
-        if 'sort' in request.GET:
+    if params:
+        if 'sort' in params:
 
             # To clarify the reason for copying the sort parameter into a new variable called sortkey.
             # Is because now we've preserved the original field we want it to sort on name.
             # But we have the actual field we're going to sort on, lower_name in the sort key variable.
             # If we had just renamed sort itself to lower_name we would have lost the original field name.
 
-            sortkey = request.GET['sort']
+            sortkey = params['sort']
             sort = sortkey
             if sortkey == 'name':
                 sortkey = 'lower_name'
@@ -44,35 +86,35 @@ def all_products(request):
             if sortkey == 'category':
                 sortkey = 'category__name'
 
-            if 'direction' in request.GET:
+            if 'direction' in params:
 
                 # Moving on to the direction parameter. All we have to do here is check whether it's descending.
                 # And if so we'll add a minus in front of the sort key using string formatting, which will reverse the order.
 
-                direction = request.GET['direction']
+                direction = params['direction']
                 if direction == 'desc':
                     sortkey = f'-{sortkey}'
 
                 # in order to actually sort the products all we need to do is use the order by model method.
+                # The ordering is also needed to work out which products are on which page.
                 products = products.order_by(sortkey)
+                ordering = sortkey
 
         # If GET has 'category' in it
-        if 'category' in request.GET:
-            categories = request.GET['category'].split(',')
+        if 'category' in params:
+            categories = params['category'].split(',')
             products = products.filter(category__name__in=categories)
             categories = Category.objects.filter(name__in=categories)
 
 
         # If GET has a 'q' parameter in it
-        if 'q' in request.GET:
-            query = request.GET['q']
-            # If the query is empty
-            if not query:
-                messages.error(request, "You didn't enter any search criteria!")
-                return redirect(reverse('products'))
-            # "i" in __icontains stands for "Case insensitive", '|' stands for "or"
-            queries = Q(name__icontains=query) | Q(description__icontains=query)
-            products = products.filter(queries)
+        if 'q' in params:
+            query = params['q']
+            # Full-text search, see products/search.py.
+            # Best matches come first unless another sort was picked.
+            products = get_search_backend().search(products, query)
+            if not direction:
+                ordering = '-search_rank'
 
     # The last thing I want to do is return the current sorting methodology to the template.
     # There are plenty of ways to do this but the easiest way is probably
@@ -81,21 +123,23 @@ def all_products(request):
 
     current_sorting = f'{sort}_{direction}'
 
-    context = {
-        'products': products,
+    # Only one page of products is rendered, see products/pagination.py
+    product_page = paginate_products(params, products, ordering)
+
+    return {
+        'products': product_page['object_list'],
+        'product_page': product_page,
         'search_term': query,
         'current_categories': categories,
         # Note that the value of 'current_sorting' variable will be the string 'None_None'. If there is no sorting.
         'current_sorting': current_sorting,
     }
 
-    return render(request, 'products/products.html', context)
-
 
 def product_detail(request, product_id):
     """ A view to show individual product details """
 
-    product = get_object_or_404(Product, pk=product_id)
+    product = get_object_or_404(Product.objects.select_related('category'), pk=product_id)
 
     context = {
         'product': product,
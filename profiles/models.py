@@ -20,14 +20,44 @@ class UserProfile(models.Model):
     default_postcode = models.CharField(max_length=20, null=True, blank=True)
     default_country = CountryField(blank_label='Country', null=True, blank=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        profile = super().from_db(db, field_names, values)
+        # Remember the values as loaded, to spot an unchanged profile
+        profile._loaded_values = profile._current_values()
+        return profile
+
+    def _current_values(self):
+        return {
+            field.attname: field.get_prep_value(getattr(self, field.attname))
+            for field in self._meta.concrete_fields
+        }
+
+    def has_changed(self):
+        """Whether the profile was changed since it was loaded or saved"""
+        return self._current_values() != getattr(self, '_loaded_values', None)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = self._current_values()
+
     def __str__(self):
         return self.user.username
 
 
 @receiver(post_save, sender=User)
 def create_or_update_user_profile(sender, instance, created, **kwargs):
-    """Create or update the user profile"""
+    """
+    Create the user profile for new users.
+    For existing users, save the profile only if it was loaded with
+    this user and changed since. Users are saved on every login to
+    update last_login, and that shouldn't write the profile as well.
+    """
     if created:
         UserProfile.objects.create(user=instance)
-    # Existing users: just save profile
-    instance.userprofile.save()
+        return
+    profile_cache = UserProfile._meta.get_field('user').remote_field
+    if profile_cache.is_cached(instance):
+        profile = profile_cache.get_cached_value(instance)
+        if profile is not None and profile.has_changed():
+            profile.save()
@@ -0,0 +1,20 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import UserProfile
+from .utils import profile_cache_key
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+    """
+    Throw away the cached copy of the profile.
+    It's thrown away again once the change is committed, in case another
+    request cached the old profile in the meantime.
+    """
+    key = profile_cache_key(instance.user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
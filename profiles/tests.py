@@ -1,3 +1,78 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from boutique_ado.testing import QueryBudgetMixin
+from checkout.models import Order, OrderLineItem
+from products.models import Product
+
+from .utils import get_user_profile
+
+
+class ProfilePageQueryTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_profile_query_budget(self):
+        with self.assertMaxQueries(5):
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(ORDERS_PER_PAGE=3)
+    def test_order_history_query_budget(self):
+        products = [
+            Product.objects.create(sku=f'sku{number}', name=f'Product {number}', description='', price=10)
+            for number in range(3)
+        ]
+        for _ in range(5):
+            order = Order.objects.create(
+                user_profile=self.user.userprofile, full_name='Shopper', email='shopper@example.com',
+                phone_number='0123456789', country='IE', town_or_city='Dublin', street_address1='1 Fake Street')
+            for product in products:
+                OrderLineItem.objects.create(order=order, product=product, quantity=2)
+
+        # The same number of queries however many orders and line items there are
+        with self.assertMaxQueries(7):
+            response = self.client.get(reverse('profile'), {'page': 2})
+        orders = response.context['orders']
+        self.assertEqual((orders.number, len(orders), orders.paginator.num_pages), (2, 2, 2))
+        self.assertEqual(orders[0].item_count, 6)
+        self.assertEqual(response.context['order_summary']['order_count'], 5)
+
+
+class ProfileCacheTests(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+
+    def test_profile_read_through_cache(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertMaxQueries(1):
+            get_user_profile(user)
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertMaxQueries(0):
+            profile = get_user_profile(user)
+            self.assertIs(profile.user, user)
+            self.assertIs(user.userprofile, profile)
+
+        profile.default_country = 'IE'
+        profile.save()
+        profile = get_user_profile(User.objects.get(pk=self.user.pk))
+        self.assertEqual(profile.default_country.code, 'IE')
+
+    def test_saving_user_skips_unchanged_profile(self):
+        user = User.objects.get(pk=self.user.pk)
+        get_user_profile(user)
+        with self.assertMaxQueries(1):
+            user.save(update_fields=['last_login'])
+
+        user.userprofile.default_postcode = 'D01'
+        user.save()
+        self.assertEqual(User.objects.get(pk=self.user.pk).userprofile.default_postcode, 'D01')
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+
+from .models import UserProfile
+
+
+def profile_cache_key(user_id):
+    return f'profiles:profile:{user_id}'
+
+
+def get_user_profile(user):
+    """
+    Return a user's profile, read through the cache.
+    The profile is kept on the user for the rest of the request, so
+    `user.userprofile` and `profile.user` don't query the database again.
+    The cached copy is thrown away whenever the profile is saved
+    (see profiles/signals.py), though only in other processes when the
+    cache is shared, which is why PROFILE_CACHE_TIMEOUT is short otherwise.
+    Raises UserProfile.DoesNotExist if the user has no profile.
+    """
+    profile_cache = UserProfile._meta.get_field('user').remote_field
+    if profile_cache.is_cached(user):
+        return user.userprofile
+
+    key = profile_cache_key(user.pk)
+    values = cache.get(key)
+    if values is None:
+        profile = UserProfile.objects.get(user=user)
+        # Plain values rather than the model, so it's a small, safe pickle
+        cache.set(key, profile._current_values(), settings.PROFILE_CACHE_TIMEOUT)
+    else:
+        profile = UserProfile.from_db(router.db_for_read(UserProfile), list(values), list(values.values()))
+
+    profile_cache.set_cached_value(user, profile)
+    UserProfile._meta.get_field('user').set_cached_value(profile, user)
+    return profile
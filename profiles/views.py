@@ -1,17 +1,46 @@
 from django.shortcuts import render, get_object_or_404
+from django.http import Http404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Count, Prefetch, Sum
+from django.db.models.functions import Coalesce
 
 from .models import UserProfile
 from .forms import UserProfileForm
+from .utils import get_user_profile
 
-from checkout.models import Order
+from checkout.models import Order, OrderLineItem
+
+
+def order_history_page(profile, page_number):
+    """
+    One page of a user's orders, newest first, each with its line items
+    and their products fetched in one query for the whole page, and the
+    number of items in each order counted by the database.
+    Also returns the number of orders and the total spent.
+    """
+    summary = profile.orders.aggregate(order_count=Count('pk'), total_spent=Sum('grand_total'))
+    lineitems = OrderLineItem.objects.select_related('product').only(
+        'order', 'product_size', 'quantity', 'product__name', 'product__has_sizes').order_by('pk')
+    orders = profile.orders.order_by('-date').defer('original_bag').annotate(
+        item_count=Coalesce(Sum('lineitems__quantity'), 0),
+    ).prefetch_related(Prefetch('lineitems', queryset=lineitems))
+
+    paginator = Paginator(orders, settings.ORDERS_PER_PAGE)
+    # The orders were already counted for the summary
+    paginator.count = summary['order_count']
+    return paginator.get_page(page_number), summary
 
 
 @login_required
 def profile(request):
     """Display the user's profile."""
-    profile = get_object_or_404(UserProfile, user=request.user)
+    try:
+        profile = get_user_profile(request.user)
+    except UserProfile.DoesNotExist:
+        raise Http404('No profile found for this user')
 
     if request.method == 'POST':
         form = UserProfileForm(request.POST, instance=profile)
@@ -22,12 +51,13 @@ def profile(request):
             messages.error(request, 'Update failed. Please ensure the form is valid.')
     else:
         form = UserProfileForm(instance=profile)
-    orders = profile.orders.all()
+    orders, order_summary = order_history_page(profile, request.GET.get('page'))
 
     template = 'profiles/profile.html'
     context = {
         'form': form,
         'orders': orders,
+        'order_summary': order_summary,
         'on_profile_page': True,
     }
 